@@ -0,0 +1,183 @@
+"""
+Microbenchmarks for the ClaimThread hot paths against the in-memory collection
+
+Run from a Modmail checkout so `core` and the bot's requirements are importable:
+    PYTHONPATH=/path/to/modmail python benchmarks/bench_claim.py --sizes 1000 100000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+import discord
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'claim'))
+
+from fakes import FakeBot, FakeChannel, FakeContext, FakeMember  # noqa: E402
+from claim import ClaimThread, MongoClaimStore, check_reply  # noqa: E402
+
+GUILD_ID = 1
+SUPPORTERS = range(1000, 1100)
+HOLDER_ID = 999
+# thread ids are real snowflakes from well before the cache grace period
+FIRST_THREAD_ID = discord.utils.time_snowflake(datetime(2023, 1, 1, tzinfo=timezone.utc))
+
+
+class Stats:
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+        self.calls = Counter()
+
+    def percentile(self, p):
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+    def row(self):
+        count = len(self.samples)
+        calls = sum(self.calls.values()) / count
+        detail = ', '.join(f'{k} {v / count:g}' for k, v in sorted(self.calls.items()))
+        us = [self.percentile(p) / 1000 for p in (50, 95, 99)] + [max(self.samples) / 1000]
+        return f'{self.name:<24}{count:>7}' + ''.join(f'{u:>12.1f}' for u in us) + f'{calls:>10.2f}  {detail}'
+
+
+def db_calls(bot):
+    calls = Counter()
+    for collection in bot.api.partitions.values():
+        calls.update(collection.calls)
+        for child in collection.children.values():
+            calls.update(child.calls)
+    calls.update({f'logs.{k}': v for k, v in bot.api.logs.calls.items()})
+    calls.update({f'api.{k}': v for k, v in bot.api_calls.items()})
+    return calls
+
+
+async def measure(bot, stats, coro):
+    before = db_calls(bot)
+    start = time.perf_counter_ns()
+    await coro
+    stats.samples.append(time.perf_counter_ns() - start)
+    stats.calls.update(db_calls(bot) - before)
+
+
+async def build(size, latency):
+    """A bot with `size` claim documents, most of them for tickets that were closed long ago"""
+    bot = FakeBot(GUILD_ID)
+    guild = bot.modmail_guild
+    live = max(size - 10_000, 0)
+    holder_threads = set(random.sample(range(live, size), min(20, size)))
+    threads = {}
+    for i in range(size):
+        thread_id = FIRST_THREAD_ID + i
+        if i in holder_threads:
+            threads[str(thread_id)] = [str(HOLDER_ID)]
+        elif i % 3 == 0:
+            threads[str(thread_id)] = []
+        else:
+            threads[str(thread_id)] = [str(random.choice(SUPPORTERS))]
+        if i >= live:
+            guild.channel_map[thread_id] = FakeChannel(thread_id, guild, recipient_id=10**17 + i)
+
+    db = bot.api.partition('ClaimThread')
+    cog = ClaimThread(bot)
+    store = cog.store.collection
+    if isinstance(store, MongoClaimStore):
+        # documents in the compact format, with nothing left to migrate
+        db.add({'_id': 'config', 'schema': 2})
+        for thread_id, claimers in threads.items():
+            db.add({'thread_id': int(thread_id), 'guild': GUILD_ID, 'claimers': [int(c) for c in claimers]})
+    await bot.add_cog(cog)
+    if not isinstance(store, MongoClaimStore):
+        await store.compare_and_set_many({t: ([], claimers) for t, claimers in threads.items() if claimers})
+    await cog.update_config({'$set': {'limit': 1_000_000, 'bypass_roles': []}})
+    await asyncio.sleep(0)
+    db.latency = latency
+    return bot, cog
+
+
+async def run(size, iterations, latency):
+    bot, cog = await build(size, latency)
+    guild = bot.modmail_guild
+    author = FakeMember(SUPPORTERS[0])
+    results = []
+
+    stats = Stats('check_reply (miss)')
+    for _ in range(iterations):
+        channel = FakeChannel(FIRST_THREAD_ID + random.randrange(size), guild)
+        await measure(bot, stats, check_reply(FakeContext(bot, author, channel)))
+    results.append(stats)
+
+    stats = Stats('check_reply (hit)')
+    hot = [FakeChannel(FIRST_THREAD_ID + random.randrange(size), guild) for _ in range(100)]
+    for channel in hot:
+        await check_reply(FakeContext(bot, author, channel))
+    for i in range(iterations):
+        await measure(bot, stats, check_reply(FakeContext(bot, author, hot[i % len(hot)])))
+    results.append(stats)
+
+    stats = Stats('load_claim_counts')
+    await measure(bot, stats, cog.load_claim_counts())
+    results.append(stats)
+
+    stats = Stats('check_claimer')
+    ctx = FakeContext(bot, author)
+    for _ in range(iterations):
+        await measure(bot, stats, cog.check_claimer(ctx, random.choice(SUPPORTERS)))
+    results.append(stats)
+
+    stats = Stats('claim')
+    for i in range(iterations):
+        thread_id = FIRST_THREAD_ID + size + i
+        channel = guild.channel_map[thread_id] = FakeChannel(thread_id, guild, recipient_id=10**17 + size + i)
+        claimer = FakeMember(random.choice(SUPPORTERS))
+        await measure(bot, stats, cog.claim_.callback(cog, FakeContext(bot, claimer, channel)))
+    results.append(stats)
+
+    stats = Stats('claims')
+    holder = FakeMember(HOLDER_ID)
+    for _ in range(min(iterations, 100)):
+        await measure(bot, stats, cog.claims.callback(cog, FakeContext(bot, holder)))
+    results.append(stats)
+
+    stats = Stats('cleanup')
+    await measure(bot, stats, cog.cleanup.callback(cog, FakeContext(bot, author)))
+    results.append(stats)
+
+    stats = Stats('claim bulk transfer')
+    await measure(bot, stats, cog.claim_bulk_transfer.callback(cog, FakeContext(bot, author), holder, author))
+    results.append(stats)
+
+    await bot.remove_cog('ClaimThread')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 100_000, 1_000_000])
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every database call')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--store', choices=['mongo', 'sqlite', 'memory'], default='mongo')
+    args = parser.parse_args()
+    os.environ['CLAIM_STORE'] = args.store
+    random.seed(args.seed)
+
+    for size in args.sizes:
+        os.environ['CLAIM_STORE_PATH'] = os.path.join(tempfile.mkdtemp(), 'claims.sqlite3')
+        results = asyncio.run(run(size, args.iterations, args.latency))
+        print(f'\n{size:,} claim documents')
+        print(f'{"operation":<24}{"runs":>7}' + ''.join(f'{h:>12}' for h in ('p50 us', 'p95 us', 'p99 us', 'max us')) + f'{"db/op":>10}  calls per op')
+        for stats in results:
+            print(stats.row())
+
+
+if __name__ == '__main__':
+    main()
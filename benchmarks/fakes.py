@@ -0,0 +1,730 @@
+"""
+Stand-ins for the parts of Modmail the claim plugin talks to
+InMemoryCollection implements the subset of the Motor collection API the plugin uses,
+with hash indexes on thread_id and claimers so lookups stay O(1) at a million documents
+"""
+
+import asyncio
+import copy
+import itertools
+import random
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import discord
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+def comparable(value, arg):
+    """Whether Mongo compares two values, which it only does within a type bracket, e.g. numbers or strings"""
+    number = (int, float)
+    return value is not None and (isinstance(value, number) and isinstance(arg, number) or type(value) is type(arg))
+
+
+OPERATORS = {
+    '$eq': lambda value, arg: value == arg,
+    '$ne': lambda value, arg: value != arg,
+    '$gt': lambda value, arg: comparable(value, arg) and value > arg,
+    '$gte': lambda value, arg: comparable(value, arg) and value >= arg,
+    '$lt': lambda value, arg: comparable(value, arg) and value < arg,
+    '$lte': lambda value, arg: comparable(value, arg) and value <= arg,
+    '$in': lambda value, arg: value in arg,
+    '$nin': lambda value, arg: value not in arg,
+}
+
+MISSING = object()
+
+
+def get_path(doc, path):
+    """Resolve a dotted path, list indexes included, returns MISSING if it doesn't exist"""
+    value = doc
+    for part in path.split('.'):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return MISSING
+    return value
+
+
+def match_value(value, condition):
+    """Match one field against a literal or an operator document, with Mongo's array semantics"""
+    if isinstance(condition, dict) and condition and all(k.startswith('$') for k in condition):
+        for op, arg in condition.items():
+            if op == '$exists':
+                if (value is not MISSING) != bool(arg):
+                    return False
+            elif op == '$all':
+                if not isinstance(value, list) or not all(a in value for a in arg):
+                    return False
+            elif op == '$size':
+                if not isinstance(value, list) or len(value) != arg:
+                    return False
+            elif op in ('$ne', '$nin'):
+                candidates = value if isinstance(value, list) else [value]
+                if not all(OPERATORS[op](None if v is MISSING else v, arg) for v in candidates):
+                    return False
+            else:
+                candidates = [value] + (value if isinstance(value, list) else [])
+                if not any(v is not MISSING and OPERATORS[op](v, arg) for v in candidates):
+                    return False
+        return True
+
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return (None if value is MISSING else value) == condition
+
+
+def matches(doc, query):
+    """Whether a document matches a query"""
+    for key, condition in query.items():
+        if key == '$and':
+            if not all(matches(doc, q) for q in condition):
+                return False
+        elif key == '$or':
+            if not any(matches(doc, q) for q in condition):
+                return False
+        elif not match_value(get_path(doc, key), condition):
+            return False
+    return True
+
+
+def apply_update(doc, update):
+    """Apply an update document in place"""
+    for op, fields in update.items():
+        for key, arg in fields.items():
+            if op in ('$set', '$setOnInsert'):
+                doc[key] = copy.deepcopy(arg)
+            elif op == '$unset':
+                doc.pop(key, None)
+            elif op == '$inc':
+                doc[key] = doc.get(key, 0) + arg
+            elif op == '$max':
+                doc[key] = max(doc.get(key, arg), arg)
+            elif op == '$min':
+                doc[key] = min(doc.get(key, arg), arg)
+            elif op in ('$addToSet', '$push'):
+                values = arg['$each'] if isinstance(arg, dict) and '$each' in arg else [arg]
+                target = doc.setdefault(key, [])
+                for value in values:
+                    if op == '$push' or value not in target:
+                        target.append(copy.deepcopy(value))
+            elif op == '$pull':
+                doc[key] = [v for v in doc.get(key, []) if not match_value(v, arg)]
+            else:
+                raise NotImplementedError(op)
+
+
+def project(doc, projection):
+    """Apply an inclusion or exclusion projection"""
+    if not projection:
+        return copy.deepcopy(doc)
+
+    include = {k for k, v in projection.items() if v and k != '_id'}
+    if include:
+        result = {k: copy.deepcopy(doc[k]) for k in include if k in doc}
+        if projection.get('_id', 1) and '_id' in doc:
+            result['_id'] = doc['_id']
+        return result
+    return {k: copy.deepcopy(v) for k, v in doc.items() if projection.get(k, 1)}
+
+
+class FakeCursor:
+    def __init__(self, collection, query, projection=None):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self.sort_key = None
+        self.limit_count = 0
+
+    def sort(self, key, direction=1):
+        self.sort_key = (key, direction)
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def documents(self):
+        docs = list(self.collection.scan(self.query))
+        if self.sort_key:
+            key, direction = self.sort_key
+            docs.sort(key=lambda d: get_path(d, key), reverse=direction < 0)
+        if self.limit_count:
+            docs = docs[:self.limit_count]
+        return [project(d, self.projection) for d in docs]
+
+    async def to_list(self, length=None):
+        self.collection.calls['find'] += 1
+        docs = self.documents()
+        return docs if length is None else docs[:length]
+
+    def __aiter__(self):
+        return self.iterate()
+
+    async def iterate(self):
+        self.collection.calls['find'] += 1
+        for doc in self.documents():
+            yield doc
+
+    async def explain(self):
+        index = self.collection.index_for(self.query)
+        stage = {'stage': 'IXSCAN', 'indexName': index} if index else {'stage': 'COLLSCAN'}
+        return {'queryPlanner': {'winningPlan': {'stage': 'FETCH', 'inputStage': stage}}}
+
+
+class InMemoryCollection:
+    """An async, in-process stand-in for a Motor collection"""
+
+    def __init__(self, name='plugins.ClaimThread'):
+        self.name = name
+        self.docs = {}
+        self.ids = itertools.count(1)
+        self.unique = []
+        self.indexes = []
+        # hash indexes, (thread_id, guild) -> _ids and claimer -> _ids
+        self.by_thread = defaultdict(set)
+        self.by_claimer = defaultdict(set)
+        self.calls = Counter()
+        self.children = {}
+        # seconds awaited per call, to model a network round trip, plus up to `jitter` more at random
+        self.latency = 0
+        self.jitter = 0
+
+    def __getitem__(self, name):
+        if name not in self.children:
+            self.children[name] = InMemoryCollection(f'{self.name}.{name}')
+        return self.children[name]
+
+    def load(self, docs):
+        """Bulk load documents without counting calls"""
+        for doc in docs:
+            self.add(copy.deepcopy(doc))
+
+    async def roundtrip(self, name):
+        self.calls[name] += 1
+        await asyncio.sleep(self.latency + random.random() * self.jitter)
+
+    def add(self, doc):
+        doc.setdefault('_id', next(self.ids))
+        self.check_unique(doc)
+        self.docs[doc['_id']] = doc
+        self.index(doc)
+
+    def index(self, doc):
+        if 'thread_id' in doc:
+            self.by_thread[(doc['thread_id'], doc.get('guild'))].add(doc['_id'])
+        for claimer in doc.get('claimers', []):
+            self.by_claimer[claimer].add(doc['_id'])
+
+    def unindex(self, doc):
+        if 'thread_id' in doc:
+            key = (doc['thread_id'], doc.get('guild'))
+            self.by_thread[key].discard(doc['_id'])
+            if not self.by_thread[key]:
+                del self.by_thread[key]
+        for claimer in doc.get('claimers', []):
+            self.by_claimer[claimer].discard(doc['_id'])
+            if not self.by_claimer[claimer]:
+                del self.by_claimer[claimer]
+
+    def check_unique(self, doc, ignore=None):
+        for keys in self.unique:
+            key = tuple(doc.get(k) for k in keys)
+            if all(k is None for k in key):
+                continue
+            for other in self.candidates({k: v for k, v in zip(keys, key)}):
+                if other['_id'] != ignore and tuple(other.get(k) for k in keys) == key:
+                    raise DuplicateKeyError(f'E11000 duplicate key {key}')
+
+    def index_for(self, query):
+        if '$or' in query:
+            indexes = [self.index_for(clause) for clause in query['$or']]
+            return indexes[0] if all(indexes) else None
+        if isinstance(query.get('thread_id'), (str, int)) and 'guild' in query:
+            return 'thread_id_1_guild_1'
+        if 'guild' in query and isinstance(query.get('claimers'), (str, int)):
+            return 'guild_1_claimers_1'
+        if 'guild' in query and any(i == [('guild', 1), ('claimers', 1)] for i in self.indexes):
+            return 'guild_1_claimers_1'
+        return None
+
+    def candidates(self, query):
+        """Narrow a query down with the hash indexes before matching"""
+        if '$or' in query:
+            rest = {k: v for k, v in query.items() if k != '$or'}
+            docs = {d['_id']: d for clause in query['$or'] for d in self.candidates({**rest, **clause})}
+            return list(docs.values())
+        thread_id = query.get('thread_id')
+        if isinstance(thread_id, (str, int)):
+            return [self.docs[i] for i in sorted(self.by_thread.get((thread_id, query.get('guild')), ()))]
+        if isinstance(thread_id, dict) and isinstance(thread_id.get('$in'), (list, set, tuple)):
+            ids = {i for t in thread_id['$in'] for i in self.by_thread.get((t, query.get('guild')), ())}
+            return [self.docs[i] for i in sorted(ids)]
+        claimer = query.get('claimers')
+        if isinstance(claimer, (str, int)):
+            return [self.docs[i] for i in self.by_claimer.get(claimer, ())]
+        if '_id' in query and not isinstance(query['_id'], dict):
+            return [self.docs[query['_id']]] if query['_id'] in self.docs else []
+        return list(self.docs.values())
+
+    def scan(self, query):
+        return [d for d in self.candidates(query) if matches(d, query)]
+
+    def upsert_seed(self, query):
+        return {k: copy.deepcopy(v) for k, v in query.items() if not k.startswith('$') and '.' not in k and not isinstance(v, dict)}
+
+    def modify(self, doc, update):
+        """Apply an update to a stored document, keeping the indexes and unique keys right"""
+        updated = copy.deepcopy(doc)
+        apply_update(updated, {k: v for k, v in update.items() if k != '$setOnInsert'})
+        self.check_unique(updated, ignore=doc['_id'])
+        self.unindex(doc)
+        self.docs[doc['_id']] = updated
+        self.index(updated)
+        return updated
+
+    async def create_index(self, keys, unique=False, **kwargs):
+        await self.roundtrip('create_index')
+        keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        if unique:
+            # like the server, a unique index can't be built over duplicate keys
+            seen = Counter(tuple(repr(get_path(d, k)) for k, _ in keys) for d in self.docs.values())
+            if any(count > 1 for count in seen.values()):
+                raise OperationFailure('E11000 duplicate key error building the unique index', code=11000)
+        if keys not in self.indexes:
+            self.indexes.append(keys)
+        if unique and [k for k, _ in keys] not in self.unique:
+            self.unique.append([k for k, _ in keys])
+        return '_'.join(f'{k}_{d}' for k, d in keys)
+
+    async def drop_index(self, name):
+        await self.roundtrip('drop_index')
+        for keys in self.indexes:
+            if '_'.join(f'{k}_{d}' for k, d in keys) == name:
+                self.indexes.remove(keys)
+                return
+        raise OperationFailure(f'index not found with name [{name}]', code=27)
+
+    def watch(self, pipeline=None, **kwargs):
+        # like a standalone server, change streams need a replica set
+        raise OperationFailure('The $changeStream stage is only supported on replica sets', code=40573)
+
+    async def find_one(self, query, projection=None):
+        await self.roundtrip('find_one')
+        docs = self.scan(query)
+        return project(docs[0], projection) if docs else None
+
+    def find(self, query=None, projection=None):
+        return FakeCursor(self, query or {}, projection)
+
+    async def count_documents(self, query):
+        await self.roundtrip('count_documents')
+        return len(self.scan(query))
+
+    async def insert_one(self, doc):
+        await self.roundtrip('insert_one')
+        doc = copy.deepcopy(doc)
+        self.add(doc)
+        return SimpleNamespace(inserted_id=doc['_id'])
+
+    async def insert_many(self, docs, ordered=True):
+        await self.roundtrip('insert_many')
+        ids = []
+        for doc in docs:
+            doc = copy.deepcopy(doc)
+            self.add(doc)
+            ids.append(doc['_id'])
+        return SimpleNamespace(inserted_ids=ids)
+
+    async def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=False, **kwargs):
+        await self.roundtrip('find_one_and_update')
+        docs = self.scan(query)
+        if docs:
+            before = copy.deepcopy(docs[0])
+            after = self.modify(docs[0], update)
+            return project(after if return_document else before, projection)
+        if upsert:
+            doc = self.upsert_seed(query)
+            apply_update(doc, update)
+            self.add(doc)
+            return project(doc, projection) if return_document else None
+        return None
+
+    async def update_one(self, query, update, upsert=False, **kwargs):
+        await self.roundtrip('update_one')
+        return self.update(query, update, upsert, many=False)
+
+    async def update_many(self, query, update, upsert=False, **kwargs):
+        await self.roundtrip('update_many')
+        return self.update(query, update, upsert, many=True)
+
+    def update(self, query, update, upsert, many):
+        docs = self.scan(query)
+        if not many:
+            docs = docs[:1]
+        for doc in docs:
+            self.modify(doc, update)
+        upserted_id = None
+        if not docs and upsert:
+            doc = self.upsert_seed(query)
+            apply_update(doc, update)
+            self.add(doc)
+            upserted_id = doc['_id']
+        return SimpleNamespace(matched_count=len(docs), modified_count=len(docs), upserted_id=upserted_id)
+
+    async def find_one_and_delete(self, query, projection=None):
+        await self.roundtrip('find_one_and_delete')
+        docs = self.scan(query)
+        if not docs:
+            return None
+        self.remove(docs[0])
+        return project(docs[0], projection)
+
+    async def delete_one(self, query):
+        await self.roundtrip('delete_one')
+        docs = self.scan(query)[:1]
+        for doc in docs:
+            self.remove(doc)
+        return SimpleNamespace(deleted_count=len(docs))
+
+    async def delete_many(self, query):
+        await self.roundtrip('delete_many')
+        docs = self.scan(query)
+        for doc in docs:
+            self.remove(doc)
+        return SimpleNamespace(deleted_count=len(docs))
+
+    def remove(self, doc):
+        self.unindex(doc)
+        del self.docs[doc['_id']]
+
+    async def bulk_write(self, requests, ordered=True):
+        await self.roundtrip('bulk_write')
+        matched = modified = 0
+        for request in requests:
+            # pymongo keeps the operation on private attributes
+            query, update = request._filter, request._doc
+            upsert = getattr(request, '_upsert', False)
+            many = type(request).__name__ == 'UpdateMany'
+            result = self.update(query, update, upsert, many)
+            matched += result.matched_count
+            modified += result.modified_count
+        return SimpleNamespace(matched_count=matched, modified_count=modified)
+
+    def aggregate(self, pipeline):
+        return FakeAggregation(self, pipeline)
+
+
+class FakeAggregation:
+    """Runs the $match, $unwind, $group, $sort and $limit stages of a pipeline"""
+
+    def __init__(self, collection, pipeline):
+        self.collection = collection
+        self.pipeline = pipeline
+
+    def __aiter__(self):
+        return self.iterate()
+
+    async def to_list(self, length=None):
+        return [x async for x in self]
+
+    async def iterate(self):
+        await self.collection.roundtrip('aggregate')
+        docs = None
+        for stage in self.pipeline:
+            (name, arg), = stage.items()
+            if name == '$match':
+                docs = self.collection.scan(arg) if docs is None else [d for d in docs if matches(d, arg)]
+                continue
+            if docs is None:
+                docs = list(self.collection.docs.values())
+            if name == '$unwind':
+                path = arg[1:]
+                docs = [{**d, path: v} for d in docs for v in (get_path(d, path) if isinstance(get_path(d, path), list) else [])]
+            elif name == '$group':
+                docs = self.group(docs, arg)
+            elif name == '$sort':
+                for key, direction in reversed(list(arg.items())):
+                    docs.sort(key=lambda d: get_path(d, key), reverse=direction < 0)
+            elif name == '$limit':
+                docs = docs[:arg]
+            elif name == '$project':
+                docs = [project(d, arg) for d in docs]
+            else:
+                raise NotImplementedError(name)
+        for doc in docs or []:
+            yield doc
+
+    @staticmethod
+    def evaluate(doc, expression):
+        if isinstance(expression, str) and expression.startswith('$'):
+            value = get_path(doc, expression[1:])
+            return None if value is MISSING else value
+        if isinstance(expression, dict):
+            return {k: FakeAggregation.evaluate(doc, v) for k, v in expression.items()}
+        return expression
+
+    def group(self, docs, spec):
+        groups = {}
+        for doc in docs:
+            key = self.evaluate(doc, spec['_id'])
+            group = groups.setdefault(repr(key), {'_id': key})
+            for field, accumulator in spec.items():
+                if field == '_id':
+                    continue
+                (op, expression), = accumulator.items()
+                value = self.evaluate(doc, expression)
+                if op == '$sum':
+                    group[field] = group.get(field, 0) + value
+                elif op == '$push':
+                    group.setdefault(field, []).append(value)
+                elif op == '$addToSet':
+                    group.setdefault(field, [])
+                    if value not in group[field]:
+                        group[field].append(value)
+                elif op == '$min':
+                    group[field] = value if field not in group else min(group[field], value)
+                elif op == '$max':
+                    group[field] = value if field not in group else max(group[field], value)
+                else:
+                    raise NotImplementedError(op)
+        return list(groups.values())
+
+
+class FakeCommand:
+    def __init__(self, name):
+        self.name = name
+        self.checks = []
+
+    def add_check(self, check):
+        self.checks.append(check)
+
+    def remove_check(self, check):
+        if check in self.checks:
+            self.checks.remove(check)
+
+
+class FakeConfig(dict):
+    def __init__(self):
+        super().__init__(subscriptions={})
+        self.updates = 0
+
+    async def update(self):
+        self.updates += 1
+        await asyncio.sleep(0)
+
+
+class FakeChannel:
+    def __init__(self, channel_id, guild, recipient_id=None):
+        self.id = channel_id
+        self.guild = guild
+        self.name = f'ticket-{channel_id}'
+        self.mention = f'<#{channel_id}>'
+        self.recipient_id = recipient_id
+        self.topic = f'User ID: {recipient_id}' if recipient_id else None
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append((content, kwargs))
+        return FakeMessage(self, content, **kwargs)
+
+
+class FakeMessage:
+    def __init__(self, channel, content=None, **kwargs):
+        self.channel = channel
+        self.content = content
+        self.embed = kwargs.get('embed')
+        self.created_at = datetime.now(timezone.utc)
+
+    async def edit(self, **kwargs):
+        self.embed = kwargs.get('embed', self.embed)
+        self.content = kwargs.get('content', self.content)
+
+    async def delete(self):
+        pass
+
+    async def add_reaction(self, emoji):
+        pass
+
+
+class FakeRole:
+    def __init__(self, role_id):
+        self.id = role_id
+        self.name = f'role-{role_id}'
+        self.mention = f'<@&{role_id}>'
+
+
+class FakeMember:
+    def __init__(self, member_id, roles=(), bot=False):
+        self.id = member_id
+        self.name = f'member{member_id}'
+        self.discriminator = '0'
+        self.mention = f'<@{member_id}>'
+        self.bot = bot
+        self.roles = list(roles)
+        self.display_avatar = SimpleNamespace(url='https://cdn.discordapp.com/embed/avatars/0.png')
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append((content, kwargs))
+        await asyncio.sleep(0)
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.channel_map = {}
+        self.members = {}
+        self.role_map = {}
+
+    @property
+    def channels(self):
+        return list(self.channel_map.values())
+
+    @property
+    def roles(self):
+        return list(self.role_map.values())
+
+    def get_channel(self, channel_id):
+        return self.channel_map.get(channel_id)
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+    def get_role(self, role_id):
+        return self.role_map.get(role_id)
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeContext:
+    def __init__(self, bot, author, channel=None):
+        self.bot = bot
+        self.author = author
+        self.guild = bot.modmail_guild
+        self.channel = channel
+        self.thread = SimpleNamespace(id=channel.id, channel=channel) if channel else None
+        self.message = FakeMessage(channel)
+        self.prefix = '?'
+        self.invoked_subcommand = None
+        self.command = None
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append((content, kwargs))
+        await asyncio.sleep(0)
+        return FakeMessage(self.channel, content, **kwargs)
+
+    reply = send
+
+    def typing(self):
+        return FakeTyping()
+
+    async def send_help(self, command=None):
+        self.sent.append(('help', {}))
+
+
+def not_found():
+    return discord.NotFound(SimpleNamespace(status=404, reason='Not Found'), 'Unknown Channel')
+
+
+class FakeAPI:
+    def __init__(self, bot):
+        self.bot = bot
+        self.partitions = {}
+        self.logs = InMemoryCollection('logs')
+
+    def get_plugin_partition(self, cog):
+        return self.partition(type(cog).__name__)
+
+    def partition(self, name):
+        if name not in self.partitions:
+            self.partitions[name] = InMemoryCollection(f'plugins.{name}')
+        return self.partitions[name]
+
+    async def get_log(self, channel_id):
+        await self.logs.roundtrip('find_one')
+        return self.logs.scan({'channel_id': str(channel_id)})[0] if self.logs.docs else {'channel_id': str(channel_id)}
+
+
+class FakeThreadManager:
+    """The thread lookups of Modmail's ThreadManager, a thread's id is its recipient's"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.cache = {}
+
+    async def find(self, *, recipient=None, channel=None, recipient_id=None):
+        await asyncio.sleep(0)
+        if channel is None or channel.recipient_id is None:
+            return None
+        return SimpleNamespace(id=channel.recipient_id, channel=channel)
+
+
+class FakeBot:
+    """Just enough of ModmailBot for ClaimThread to run outside Discord"""
+
+    def __init__(self, guild_id=1):
+        self.modmail_guild = FakeGuild(guild_id)
+        self.guild = self.modmail_guild
+        self.api = FakeAPI(self)
+        self.config = FakeConfig()
+        self.main_color = 0x7289DA
+        self.commands = {name: FakeCommand(name) for name in ('reply', 'areply', 'freply', 'fareply')}
+        self.cogs = {}
+        self.users = {}
+        self.api_calls = Counter()
+        self.threads = FakeThreadManager(self)
+        self.user = FakeMember(0, bot=True)
+
+    def get_command(self, name):
+        return self.commands.get(name)
+
+    def get_cog(self, name):
+        return self.cogs.get(name)
+
+    async def add_cog(self, cog):
+        self.cogs[type(cog).__name__] = cog
+        if hasattr(cog, 'cog_load'):
+            await cog.cog_load()
+
+    async def remove_cog(self, name):
+        cog = self.cogs.pop(name)
+        if hasattr(cog, 'cog_unload'):
+            result = cog.cog_unload()
+            if asyncio.iscoroutine(result):
+                await result
+
+    def get_user(self, user_id):
+        return self.users.get(user_id)
+
+    async def fetch_user(self, user_id):
+        self.api_calls['fetch_user'] += 1
+        await asyncio.sleep(0)
+        return self.users.setdefault(user_id, FakeMember(user_id))
+
+    def get_channel(self, channel_id):
+        return self.modmail_guild.get_channel(channel_id)
+
+    async def fetch_channel(self, channel_id):
+        self.api_calls['fetch_channel'] += 1
+        await asyncio.sleep(0)
+        if channel := self.modmail_guild.get_channel(channel_id):
+            return channel
+        raise not_found()
+
+    async def wait_until_ready(self):
+        pass
+
+    def dispatch(self, event, *args):
+        for cog in self.cogs.values():
+            if listener := getattr(cog, f'on_{event}', None):
+                asyncio.create_task(listener(*args))
@@ -0,0 +1,240 @@
+"""
+Concurrency soak test for ClaimThread against the in-memory collection
+
+Fires thousands of concurrent claim, addclaim, transferclaim, unclaim and reply checks with
+randomized database latency, then checks the claim invariants. Exits with 1 on any violation.
+With --migrate the threads start out as documents in the old string format, converted by the
+cog's background migration while the claims run.
+Run from a Modmail checkout so `core` and the bot's requirements are importable:
+    PYTHONPATH=/path/to/modmail python benchmarks/soak_claim.py --operations 20000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'claim'))
+
+from fakes import FakeBot, FakeChannel, FakeContext, FakeMember  # noqa: E402
+from claim import ClaimThread, check_reply  # noqa: E402
+from bench_claim import FIRST_THREAD_ID, GUILD_ID  # noqa: E402
+
+CLAIMED = 'Please respond to the case asap.'
+
+
+def claim_won(ctx):
+    """Whether a claim invocation reported that it won the thread"""
+    for _, kwargs in ctx.sent:
+        embed = kwargs.get('embed')
+        if embed is not None and embed.description and CLAIMED in embed.description:
+            return True
+    return False
+
+
+class Soak:
+    def __init__(self, args):
+        self.args = args
+        self.bot = FakeBot(GUILD_ID)
+        self.db = self.bot.api.partition('ClaimThread')
+        guild = self.bot.modmail_guild
+        self.channels = []
+        for i in range(args.threads):
+            thread_id = FIRST_THREAD_ID + i
+            guild.channel_map[thread_id] = FakeChannel(thread_id, guild, recipient_id=10**17 + i)
+            self.channels.append(guild.channel_map[thread_id])
+        self.supporters = [FakeMember(1000 + i) for i in range(args.supporters)]
+        self.ops = Counter()
+        self.errors = Counter()
+        self.winners = Counter()
+        # who should stay subscribed: storm contenders subscribe, unclaim unsubscribes
+        self.subscribers = defaultdict(set)
+        self.unsubscribers = defaultdict(set)
+        self.cog = None
+        self.migrating = False
+
+    async def invoke(self, name, coro):
+        try:
+            await coro
+        except Exception as e:
+            self.errors[f'{name}: {type(e).__name__}'] += 1
+        self.ops[name] += 1
+
+    async def claim(self, member, channel):
+        ctx = FakeContext(self.bot, member, channel)
+        await self.cog.claim_.callback(self.cog, ctx)
+        # a member at the claim limit is turned away before subscribing
+        if not any(content and content.startswith('Limit reached') for content, _ in ctx.sent):
+            self.subscribers[str(channel.id)].add(member.mention)
+        if claim_won(ctx):
+            self.winners[channel.id] += 1
+
+    def operation(self):
+        """A random command against a random thread"""
+        cog = self.cog
+        channel = random.choice(self.channels)
+        member, other = random.sample(self.supporters, 2)
+        ctx = FakeContext(self.bot, member, channel)
+        name = random.choices(
+            ['reply', 'claim', 'addclaim', 'transferclaim', 'unclaim'],
+            weights=[60, 15, 8, 7, 10]
+        )[0]
+        if name == 'reply':
+            coro = check_reply(ctx)
+        elif name == 'claim':
+            coro = cog.claim_.callback(cog, ctx, False)
+        elif name == 'addclaim':
+            coro = cog.addclaim.callback(cog, ctx, member=other)
+        elif name == 'transferclaim':
+            coro = cog.transferclaim.callback(cog, ctx, member=other)
+        else:
+            self.unsubscribers[str(channel.id)].add(member.mention)
+            coro = cog.unclaim.callback(cog, ctx)
+        return self.invoke(name, coro)
+
+    def seed_legacy(self):
+        """Store every thread the way older versions did, with string ids and no version, and give each a log"""
+        self.db.load({'thread_id': str(c.id), 'guild': str(GUILD_ID), 'claimers': []} for c in self.channels)
+        self.bot.api.logs.load(
+            {'channel_id': str(c.id), 'recipient': {'id': str(c.recipient_id)}, 'open': True} for c in self.channels
+        )
+
+    async def run(self):
+        if self.args.migrate:
+            self.seed_legacy()
+        self.cog = ClaimThread(self.bot)
+        await self.bot.add_cog(self.cog)
+        await self.cog.update_config({'$set': {'limit': self.args.limit, 'bypass_roles': []}})
+        self.db.jitter = self.args.jitter
+        start = time.perf_counter()
+
+        # every thread gets claimed by several supporters at the same moment
+        storm = [
+            self.invoke('claim', self.claim(member, channel))
+            for channel in self.channels
+            for member in random.sample(self.supporters, self.args.contenders)
+        ]
+        random.shuffle(storm)
+        await asyncio.gather(*storm)
+        first_claims = dict(self.winners)
+
+        await asyncio.gather(*(self.operation() for _ in range(self.args.operations)))
+        elapsed = time.perf_counter() - start
+
+        await asyncio.sleep(self.args.jitter * 2)
+        if self.args.migrate:
+            self.migrating = not self.cog.migration.done()
+            await self.cog.migration
+        violations = await self.check(first_claims)
+        await self.bot.remove_cog('ClaimThread')
+        return elapsed, violations
+
+    async def check(self, first_claims):
+        """Compare the store against the cog's view and the claim invariants"""
+        violations = defaultdict(list)
+        store = self.cog.store
+        stored = {t: tuple((await store.get(t))[0]) for t in (await store.thread_ids())[0]}
+
+        for thread_id, count in first_claims.items():
+            if count > 1:
+                violations['more than one initial claimer'].append(f'{thread_id}: {count} winners')
+        for channel in self.channels:
+            if channel.id not in first_claims:
+                violations['thread left unclaimed by the storm'].append(str(channel.id))
+
+        if self.args.migrate:
+            if self.migrating:
+                print('migration was still running when the operations finished')
+            for d in self.db.docs.values():
+                if 'thread_id' in d and isinstance(d['thread_id'], str):
+                    violations['unmigrated documents'].append(d['thread_id'])
+                elif 'thread_id' in d and 'recipient_id' not in d:
+                    violations['migrated documents without a recipient'].append(str(d['thread_id']))
+            if store.legacy or (await store.get_config()).get('schema') != 2:
+                violations['migration not finished'].append(f'schema {(await store.get_config()).get("schema")}')
+
+        # only the mongo store keeps documents in the fake partition
+        per_thread = Counter(d['thread_id'] for d in self.db.docs.values() if 'thread_id' in d)
+        for thread_id, count in per_thread.items():
+            if count > 1:
+                violations['duplicate thread documents'].append(f'{thread_id}: {count}')
+
+        actual = Counter(c for claimers in stored.values() for c in set(claimers))
+        for claimer, count in actual.items():
+            if count > self.args.limit:
+                violations['claims above limit'].append(f'{claimer}: {count}')
+
+        counts = self.cog.claim_counts or Counter()
+        for claimer in set(actual) | set(counts):
+            if counts[claimer] != actual[claimer]:
+                violations['lost counter updates'].append(f'{claimer}: counter {counts[claimer]}, database {actual[claimer]}')
+
+        for thread_id, claimers in self.cog.cache.items():
+            if claimers != stored.get(thread_id, ()):
+                violations['stale cache entries'].append(f'{thread_id}: cache {claimers}, database {stored.get(thread_id)}')
+
+        subscriptions = self.bot.config['subscriptions']
+        for thread_id in set(subscriptions) | set(self.subscribers):
+            subscribed = subscriptions.get(thread_id, [])
+            expected = self.subscribers[thread_id] - self.unsubscribers[thread_id]
+            for mention in set(subscribed) - expected:
+                violations['orphaned subscriptions'].append(f'{thread_id}: {mention}')
+            for mention in expected - set(subscribed):
+                violations['lost subscriptions'].append(f'{thread_id}: {mention}')
+            if len(subscribed) != len(set(subscribed)):
+                violations['duplicate subscriptions'].append(thread_id)
+
+        return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=200)
+    parser.add_argument('--supporters', type=int, default=40)
+    parser.add_argument('--contenders', type=int, default=5, help='supporters claiming each thread at once')
+    parser.add_argument('--operations', type=int, default=10_000)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--jitter', type=float, default=0.005, help='max random seconds added to every database call')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--store', choices=['mongo', 'sqlite', 'memory'], default='mongo')
+    parser.add_argument('--migrate', action='store_true', help='start from old string documents, mongo only')
+    args = parser.parse_args()
+    if args.migrate and args.store != 'mongo':
+        parser.error('--migrate needs --store mongo')
+    os.environ['CLAIM_STORE'] = args.store
+    os.environ['CLAIM_STORE_PATH'] = os.path.join(tempfile.mkdtemp(), 'claims.sqlite3')
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    soak = Soak(args)
+    elapsed, violations = asyncio.run(soak.run())
+
+    total = sum(soak.ops.values())
+    print(f'{total:,} operations in {elapsed:.2f}s, {total / elapsed:,.0f} ops/s')
+    for name, count in sorted(soak.ops.items()):
+        print(f'  {name:<16}{count:>8}')
+    if soak.errors:
+        print('errors:')
+        for name, count in soak.errors.most_common():
+            print(f'  {name:<40}{count:>8}')
+
+    if not violations:
+        print('no invariant violations')
+        return 0
+
+    print('invariant violations:')
+    for name, found in violations.items():
+        print(f'  {name}: {len(found)}')
+        for example in found[:5]:
+            print(f'    {example}')
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,51 +2,2175 @@
 # Slightly modified for Minion_Kadin#2022 (discord)
 # Please use the original plugin as this one may cause your bot to nuke the world
 
+import asyncio
+import bisect
+import concurrent.futures
+import contextlib
+import contextvars
+import functools
+import heapq
+import inspect
+import io
+import json
+import math
+import os
+import random
+import secrets
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict, deque, namedtuple
+from datetime import timedelta
+from pathlib import Path
+
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
 
 from core import checks
-from core.models import PermissionLevel
+from core.models import PermissionLevel, getLogger
+from core.paginator import EmbedPaginatorSession
 from core.utils import match_user_id
 
+logger = getLogger(__name__)
+
+# Immutable snapshot of the config document, swapped whole on every write
+ClaimConfig = namedtuple('ClaimConfig', ['limit', 'bypass_roles', 'reaper', 'trace', 'idle', 'sla', 'board'])
+
+# claim events are kept this many seconds, the rollups built from them are kept for good
+EVENT_RETENTION = 90 * 24 * 3600
+# upper bounds in minutes of the time to claim histogram kept in the rollups
+WAIT_BUCKETS = [1, 5, 15, 30, 60, 120, 240, 480, 1440, math.inf]
+
+
+# the span the current task is inside of, so new spans nest under it
+current_span = contextvars.ContextVar('claim_span', default=None)
+
+
+class Tracer:
+    """
+    Opt-in span tracing to a rotating local JSONL file
+    Finished spans are buffered in memory and written by a background task off the event loop
+    """
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backups=3, max_buffer=10000):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.max_buffer = max_buffer
+        self.enabled = False
+        self.buffer = []
+        self.dropped = 0
+        self.writer = None
+
+    def start(self, name, **attrs):
+        """Open a span nested under the current one, returns None when tracing is off"""
+        if not self.enabled:
+            return None
+
+        parent = current_span.get()
+        span = {
+            'trace': parent['trace'] if parent else secrets.token_hex(8),
+            'span': secrets.token_hex(8),
+            'parent': parent['span'] if parent else None,
+            'name': name,
+            'start': time.time(),
+            **attrs,
+        }
+        return span, current_span.set(span), time.perf_counter()
+
+    def finish(self, token, error=None):
+        """Close a span opened by start() and queue it for writing"""
+        if token is None:
+            return
+
+        span, context_token, start = token
+        span['duration_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        if error:
+            span['error'] = error if isinstance(error, str) else type(error).__name__
+        try:
+            current_span.reset(context_token)
+        except ValueError:
+            # finished from another context than the one it was started in
+            pass
+
+        if len(self.buffer) >= self.max_buffer:
+            self.dropped += 1
+        else:
+            self.buffer.append(span)
+
+    def start_writer(self, interval=1):
+        async def run():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.flush()
+                except Exception:
+                    # the spans of a failed write are lost, tracing goes on
+                    logger.exception('Failed to write claim spans to %s.', self.path)
+
+        self.writer = asyncio.create_task(run())
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.cancel()
+            self.writer = None
+        await self.flush()
+
+    async def flush(self):
+        if self.buffer:
+            spans, self.buffer = self.buffer, []
+            await asyncio.to_thread(self.write, spans)
+
+    def write(self, spans):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.exists() and self.path.stat().st_size >= self.max_bytes:
+            self.rotate()
+        with self.path.open('a', encoding='utf-8') as f:
+            f.writelines(json.dumps(span) + '\n' for span in spans)
+
+    def rotate(self):
+        """Shift claim_trace.jsonl to .1, .1 to .2 and so on, dropping the oldest"""
+        for i in range(self.backups, 0, -1):
+            source = self.path if i == 1 else Path(f'{self.path}.{i - 1}')
+            if source.exists():
+                source.replace(f'{self.path}.{i}')
+
+
+class Metrics:
+    """Counters and fixed-bucket latency histograms, cheap enough to record on every call"""
+
+    # bucket upper bounds in seconds, from 50us doubling up to about 7 minutes
+    buckets = [0.00005 * 2 ** i for i in range(24)]
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self.histograms = {}
+        self.counters = Counter()
+
+    def observe(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = [0] * (len(self.buckets) + 1)
+        histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def start(self, name, **attrs):
+        """Start timing an operation, with a span if tracing is on, returns a token for finish()"""
+        return name, time.perf_counter(), self.tracer.start(name, **attrs)
+
+    def finish(self, token, error=None):
+        name, start, span = token
+        self.observe(name, time.perf_counter() - start)
+        self.tracer.finish(span, error)
+
+    async def timed(self, name, awaitable):
+        """Await something and record how long it took"""
+        token = self.start(name)
+        error = None
+        try:
+            return await awaitable
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.finish(token, error)
+
+    def percentile(self, name, p):
+        """Upper bound in seconds of the bucket holding the p-th percentile"""
+        histogram = self.histograms[name]
+        rank = p / 100 * sum(histogram)
+        seen = 0
+        for bound, count in zip(self.buckets + [math.inf], histogram):
+            seen += count
+            if count and seen >= rank:
+                return bound
+
+
+def metered(name):
+    """Record the latency of every call to a cog coroutine method"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            return await self.metrics.timed(name, func(self, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+class MeteredCollection:
+    """Wraps a Motor collection to time every database operation by type"""
+
+    def __init__(self, collection, metrics, prefix='db'):
+        self.collection = collection
+        self.metrics = metrics
+        self.prefix = prefix
+
+    def __getitem__(self, name):
+        return MeteredCollection(self.collection[name], self.metrics, f'{self.prefix}.{name}')
+
+    def __getattr__(self, name):
+        attr = getattr(self.collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if inspect.isawaitable(result):
+                return self.metrics.timed(f'{self.prefix}.{name}', result)
+            if hasattr(result, '__aiter__'):
+                return MeteredCursor(result, self.metrics, f'{self.prefix}.{name}')
+            return result
+        return call
+
+
+class MeteredCursor:
+    """Wraps a Motor cursor to record the wall time of iterating it"""
+
+    def __init__(self, cursor, metrics, name):
+        self.cursor = cursor
+        self.metrics = metrics
+        self.name = name
+
+    def sort(self, *args, **kwargs):
+        self.cursor = self.cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, *args, **kwargs):
+        self.cursor = self.cursor.limit(*args, **kwargs)
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    async def to_list(self, length=None):
+        return await self.metrics.timed(self.name, self.cursor.to_list(length))
+
+    def __aiter__(self):
+        return self.iterate()
+
+    async def iterate(self):
+        token = self.metrics.start(self.name)
+        try:
+            async for x in self.cursor:
+                yield x
+        finally:
+            self.metrics.finish(token)
+
+
+class Timers:
+    """
+    One-shot timers keyed by (kind, thread_id), all on a single heap served by one task
+    Rearming or cancelling only touches the deadline table, outdated heap entries are skipped when they come up
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.deadlines = {}
+        self.started = {}
+        self.heap = []
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def arm(self, key, delay, elapsed=0):
+        """
+        Fire the callback for key after delay seconds, replacing an earlier deadline
+        elapsed: seconds of the delay already gone by, a timer past its deadline fires right away
+        """
+        self.started[key] = time.monotonic() - elapsed
+        self.schedule(key, self.started[key] + delay)
+
+    def rearm(self, kind, delay):
+        """Move the deadline of every armed timer of a kind to delay seconds after it was armed, 0 cancels them"""
+        for key in [k for k in self.deadlines if k[0] == kind]:
+            if delay:
+                self.schedule(key, self.started[key] + delay)
+            else:
+                self.cancel(key)
+
+    def schedule(self, key, deadline):
+        self.deadlines[key] = deadline
+        heapq.heappush(self.heap, (deadline, key))
+        if self.heap[0] == (deadline, key):
+            self.wakeup.set()
+        if len(self.heap) > 2 * len(self.deadlines) + 100:
+            self.heap = sorted((d, k) for k, d in self.deadlines.items())
+
+    def cancel(self, key):
+        self.deadlines.pop(key, None)
+        self.started.pop(key, None)
+
+    def armed(self, key):
+        return key in self.deadlines
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    async def run(self):
+        while True:
+            while self.heap and self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+                heapq.heappop(self.heap)
+
+            timeout = self.heap[0][0] - time.monotonic() if self.heap else None
+            if timeout is None or timeout > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, key = heapq.heappop(self.heap)
+            del self.deadlines[key]
+            del self.started[key]
+            try:
+                await self.callback(*key)
+            except Exception:
+                logger.exception('Claim timer %s failed.', key)
+
+
+class ClaimStore:
+    """
+    Where claims and the config document live, the cog only talks to this interface
+    Claimers are lists of member id strings, a thread nobody claimed has [] whether it was stored or not
+    Every write is a single atomic operation, so the cog's cache and claim counts can follow it exactly
+    Every write also bumps the version of the thread or config document, so caches can tell newer state from older
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        # queues of the watchers in this process, for stores without a change feed of their own
+        self.watchers = []
+        # whether the store rejects a second first claim of a thread on its own
+        self.unique_threads = True
+
+    @property
+    def guild(self):
+        return str(self.bot.modmail_guild.id)
+
+    async def setup(self):
+        """Create whatever the store needs, called once when the cog loads"""
+
+    async def close(self):
+        pass
+
+    def publish(self, kind, key, version, value):
+        for queue in self.watchers:
+            queue.put_nowait((kind, key, version, value))
+
+    async def watch(self):
+        """
+        Yield (kind, key, version, value) for every write, kind is 'thread' or 'config'
+        Only writes published through this store object are seen, i.e. the ones made in this process
+        """
+        queue = asyncio.Queue()
+        self.watchers.append(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.watchers.remove(queue)
+
+    async def get(self, thread_id):
+        """The claimers of a thread and their version, 0 if it was never written"""
+        raise NotImplementedError
+
+    async def compare_and_set(self, thread_id, old, new, recipient_id=None):
+        """
+        Replace the claimers of a thread with new if they are still old
+        Returns the new version, 0 if they weren't, and whether this gave the thread its first claimers ever
+        recipient_id: remember who the thread is with, kept by later writes that don't pass it
+        """
+        raise NotImplementedError
+
+    async def compare_and_set_many(self, changes):
+        """
+        compare_and_set for many threads in one write, returns how many were written and the new versions
+        changes: thread_id -> (old claimers, new claimers)
+        The versions map written threads to their new version, a thread the store lost track of meanwhile is left out
+        """
+        raise NotImplementedError
+
+    async def pull_claimer(self, claimer_id):
+        """
+        Remove a member from the claimers of every thread
+        Returns the claimers each of their threads is left with and the new versions, like compare_and_set_many
+        """
+        raise NotImplementedError
+
+    async def delete(self, thread_ids):
+        """Forget threads, returns the claimers each deleted thread had"""
+        raise NotImplementedError
+
+    async def claim_counts(self):
+        """The number of threads every claimer holds"""
+        raise NotImplementedError
+
+    async def threads_of(self, claimer_id):
+        """The claimers of every thread a member claimed"""
+        raise NotImplementedError
+
+    async def claims_by_claimer(self):
+        """The ids of the threads every claimer holds, in one query"""
+        raise NotImplementedError
+
+    async def claimed(self, thread_ids):
+        """The claimers of the given threads that somebody claimed"""
+        raise NotImplementedError
+
+    async def recipients(self, thread_ids):
+        """The recipient ids remembered for the given threads, threads without one are left out"""
+        raise NotImplementedError
+
+    async def thread_ids(self, after=None, limit=None):
+        """
+        Stored thread ids a page at a time, returns them and the position the next page starts after
+        The position is None once there are no more, passing None starts from the beginning
+        """
+        raise NotImplementedError
+
+    async def migrate(self):
+        """Bring documents written by older versions to the current format, returns how many were converted"""
+        return 0
+
+    async def get_config(self):
+        """The config document, {} if there is none"""
+        raise NotImplementedError
+
+    async def update_config(self, update):
+        """Apply a $set, $addToSet or $pull update to the config document, returns the result"""
+        raise NotImplementedError
+
+    async def append_events(self, events):
+        """Append claim events to the log, which forgets them after EVENT_RETENTION"""
+        raise NotImplementedError
+
+    async def add_rollups(self, increments):
+        """
+        Add to the rollup counters in one round trip
+        increments: (period, start, claimer_id) -> Counter of field increments
+        """
+        raise NotImplementedError
+
+    async def rollups(self, period, since):
+        """The rollup counters of a period ('hour' or 'day') from since on, as (start, claimer_id, Counter) triples"""
+        raise NotImplementedError
+
+    async def query_plans(self, thread_id, claimer_id):
+        """How the store runs its hot queries, as (name, plan, whether it scans everything) triples"""
+        return []
+
+
+class MongoClaimStore(ClaimStore):
+    """
+    Claims in the plugin partition of the bot's database, one document per thread
+    Ids are stored as int64 and a thread document also keeps its recipient_id once a claim brings it
+    Documents written by older versions use decimal strings, until migrate() converts them every query matches both
+    """
+
+    def __init__(self, bot, db):
+        super().__init__(bot)
+        self.db = db
+        # whether documents in the decimal string format may still exist
+        self.legacy = True
+
+    @property
+    def guild(self):
+        return self.bot.modmail_guild.id
+
+    async def setup(self):
+        try:
+            # compare_and_set relies on this to reject a second upsert of the same thread
+            await self.db.create_index([('thread_id', 1), ('guild', 1)], unique=True)
+        except OperationFailure:
+            merged = await self.merge_duplicates()
+            logger.warning('Merged %d duplicate thread documents to create the unique thread index.', merged)
+            with contextlib.suppress(OperationFailure):
+                # a non-unique index left by an earlier failed attempt has the same name
+                await self.db.drop_index('thread_id_1_guild_1')
+            try:
+                await self.db.create_index([('thread_id', 1), ('guild', 1)], unique=True)
+            except OperationFailure:
+                logger.exception('Could not create the unique thread index, falling back to a non-unique one.')
+                await self.db.create_index([('thread_id', 1), ('guild', 1)])
+                self.unique_threads = False
+
+        # multikey index on claimers, covers the per-member lookups and the guild-wide scans
+        await self.db.create_index([('guild', 1), ('claimers', 1)])
+
+        # the event log expires on its own, the rollups are read a period at a time
+        await self.db['events'].create_index('at', expireAfterSeconds=EVENT_RETENTION)
+        await self.db['rollups'].create_index([('guild', 1), ('period', 1), ('start', 1)])
+
+        self.legacy = (await self.get_config()).get('schema', 1) < 2
+
+    async def merge_duplicates(self):
+        """
+        Fold the documents of a thread inserted more than once into one holding all their claimers
+        Older versions could insert a thread twice, which keeps the unique thread index from being built
+        Returns how many documents were removed
+        """
+        pipeline = [
+            {'$match': {'thread_id': {'$exists': True}}},
+            {'$group': {'_id': {'thread_id': '$thread_id', 'guild': '$guild'}, 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+            {'$match': {'count': {'$gt': 1}}},
+        ]
+        removed = 0
+        async for group in self.db.aggregate(pipeline):
+            keep, *rest = [x async for x in self.db.find({'_id': {'$in': group['ids']}})]
+            docs = [keep, *rest]
+            update = {
+                'claimers': list(dict.fromkeys(c for x in docs for c in x.get('claimers', []))),
+                'version': max(x.get('version', 0) for x in docs) + 1,
+            }
+            if recipients := [x['recipient_id'] for x in docs if 'recipient_id' in x]:
+                update['recipient_id'] = recipients[0]
+            await self.db.update_one({'_id': keep['_id']}, {'$set': update})
+            await self.db.delete_many({'_id': {'$in': [x['_id'] for x in rest]}})
+            removed += len(rest)
+        return removed
+
+    def filter(self, query):
+        """A query on the compact format, which also matches documents in the string format until they are migrated"""
+        return {'$or': [query, legacy_query(query)]} if self.legacy else query
+
+    def query(self, thread_id, claimers):
+        query = {'thread_id': int(thread_id), 'guild': self.guild}
+        if claimers:
+            query['claimers'] = [int(c) for c in claimers]
+        else:
+            query['claimers.0'] = {'$exists': False}
+        return query
+
+    def document(self, thread_id, claimers, recipient_id=None):
+        # a write converts a document in the string format as a whole
+        document = {'thread_id': int(thread_id), 'guild': self.guild, 'claimers': [int(c) for c in claimers]}
+        if recipient_id is not None:
+            document['recipient_id'] = int(recipient_id)
+        if claimers:
+            # marks the thread as claimed at some point, compare_and_set tells first claims from later ones by it
+            document['claimed'] = True
+        return document
+
+    @staticmethod
+    def written(before, new):
+        """The version and first claim flag of a compare_and_set, from the document as it was before the update"""
+        before = before or {}
+        first = bool(new) and not before.get('claimed') and not before.get('claimers')
+        return before.get('version', 0) + 1, first
+
+    async def get(self, thread_id):
+        thread = await self.db.find_one(self.filter({'thread_id': int(thread_id), 'guild': self.guild}))
+        return ([str(c) for c in thread.get('claimers', [])], thread.get('version', 0)) if thread else ([], 0)
+
+    async def compare_and_set(self, thread_id, old, new, recipient_id=None):
+        update = {'$set': self.document(thread_id, new, recipient_id), '$inc': {'version': 1}}
+        # the version is incremented atomically, so the document before the update tells the version written
+        projection = {'_id': 0, 'version': 1, 'claimed': 1, 'claimers': 1}
+        if old or self.legacy:
+            thread = await self.db.find_one_and_update(
+                self.filter(self.query(thread_id, old)), update, projection, return_document=ReturnDocument.BEFORE
+            )
+            if thread or old:
+                return self.written(thread, new) if thread else (0, False)
+            # the unique index only tells apart threads stored in the same format, look for a claimed string one first
+            if await self.db.find_one(self.filter({'thread_id': int(thread_id), 'guild': self.guild}), {'_id': 1}):
+                return 0, False
+
+        try:
+            # a thread without claimers may not have a document yet, the upsert creates it and returns None
+            thread = await self.db.find_one_and_update(
+                self.query(thread_id, old), update, projection, upsert=True, return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            # the thread document exists and somebody holds it
+            return 0, False
+        return self.written(thread, new)
+
+    async def compare_and_set_many(self, changes):
+        result = await self.db.bulk_write([
+            UpdateOne(self.filter(self.query(thread_id, old)), {'$set': self.document(thread_id, new), '$inc': {'version': 1}})
+            for thread_id, (old, new) in changes.items()
+        ], ordered=False)
+        if result.matched_count < len(changes):
+            # there is no telling which threads were written
+            return result.matched_count, {}
+        return result.matched_count, await self.versions({t: new for t, (_, new) in changes.items()})
+
+    async def pull_claimer(self, claimer_id):
+        query = self.filter({'guild': self.guild, 'claimers': int(claimer_id)})
+        threads = {
+            str(x['thread_id']): [str(c) for c in x['claimers'] if str(c) != str(claimer_id)]
+            async for x in self.db.find(query, {'_id': 0, 'thread_id': 1, 'claimers': 1})
+        }
+        await self.db.update_many(
+            query, {'$pull': {'claimers': {'$in': [int(claimer_id), str(claimer_id)]}}, '$inc': {'version': 1}}
+        )
+        return threads, await self.versions(threads)
+
+    async def versions(self, threads):
+        """
+        Read back the versions of written threads, update_many and bulk_write don't return them
+        A thread whose claimers changed again since is left out
+        """
+        if not threads:
+            return {}
+        cursor = self.db.find(
+            self.filter({'guild': self.guild, 'thread_id': {'$in': [int(t) for t in threads]}}),
+            {'_id': 0, 'thread_id': 1, 'claimers': 1, 'version': 1},
+        )
+        return {
+            str(x['thread_id']): x['version']
+            async for x in cursor
+            if [str(c) for c in x.get('claimers', [])] == threads[str(x['thread_id'])]
+        }
+
+    async def delete(self, thread_ids):
+        query = self.filter({'thread_id': {'$in': [int(t) for t in thread_ids]}, 'guild': self.guild})
+        threads = {
+            str(x['thread_id']): [str(c) for c in x.get('claimers', [])]
+            async for x in self.db.find(query, {'_id': 0, 'thread_id': 1, 'claimers': 1})
+        }
+        await self.db.delete_many(query)
+        return threads
+
+    async def claim_counts(self):
+        pipeline = [
+            {'$match': self.filter({'guild': self.guild})},
+            {'$unwind': '$claimers'},
+            {'$group': {'_id': '$claimers', 'count': {'$sum': 1}}},
+        ]
+        counts = Counter()
+        async for x in self.db.aggregate(pipeline):
+            counts[str(x['_id'])] += x['count']
+        return counts
+
+    async def threads_of(self, claimer_id):
+        cursor = self.db.find(
+            self.filter({'guild': self.guild, 'claimers': int(claimer_id)}), {'_id': 0, 'thread_id': 1, 'claimers': 1}
+        )
+        return {str(x['thread_id']): [str(c) for c in x['claimers']] async for x in cursor}
+
+    async def claims_by_claimer(self):
+        pipeline = [
+            {'$match': self.filter({'guild': self.guild, 'claimers.0': {'$exists': True}})},
+            {'$unwind': '$claimers'},
+            {'$group': {'_id': '$claimers', 'threads': {'$push': '$thread_id'}}},
+        ]
+        threads = {}
+        async for x in self.db.aggregate(pipeline):
+            threads.setdefault(str(x['_id']), []).extend(str(t) for t in x['threads'])
+        return threads
+
+    async def claimed(self, thread_ids):
+        cursor = self.db.find(
+            self.filter({'guild': self.guild, 'thread_id': {'$in': [int(t) for t in thread_ids]}, 'claimers.0': {'$exists': True}}),
+            {'_id': 0, 'thread_id': 1, 'claimers': 1}
+        )
+        return {str(x['thread_id']): [str(c) for c in x['claimers']] async for x in cursor}
+
+    async def recipients(self, thread_ids):
+        cursor = self.db.find(
+            self.filter({'guild': self.guild, 'thread_id': {'$in': [int(t) for t in thread_ids]}, 'recipient_id': {'$exists': True}}),
+            {'_id': 0, 'thread_id': 1, 'recipient_id': 1}
+        )
+        return {str(x['thread_id']): int(x['recipient_id']) async for x in cursor}
+
+    async def thread_ids(self, after=None, limit=None):
+        # thread ids in the two formats don't sort together, _id orders both and is indexed
+        query = self.filter({'guild': self.guild, 'thread_id': {'$exists': True}})
+        if after is not None:
+            query = {'$and': [query, {'_id': {'$gt': after}}]}
+        cursor = self.db.find(query, {'_id': 1, 'thread_id': 1}).sort('_id', 1)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        docs = [x async for x in cursor]
+        position = docs[-1]['_id'] if limit is not None and len(docs) == limit else None
+        return [str(x['thread_id']) for x in docs], position
+
+    async def migrate(self, batch=500, pause=0.1):
+        """
+        Convert the documents in the string format to the compact one a batch at a time, taking recipients from the logs
+        Documents other writes converted meanwhile get their recipient filled in the same way
+        A document changed between reading and converting it is left for the next pass, passes repeat until one converts nothing
+        Returns how many documents were converted
+        """
+        if not self.legacy:
+            return 0
+
+        converted = 0
+        while True:
+            found, written = await self.migrate_pass(batch, pause)
+            converted += written
+            if not found or not written:
+                break
+
+        if not await self.db.find_one({'guild': str(self.guild)}, {'_id': 1}):
+            await self.update_config({'$set': {'schema': 2}})
+            self.legacy = False
+        return converted
+
+    async def migrate_pass(self, batch, pause):
+        """One sweep over the documents left to migrate, returns how many were found and how many written"""
+        found = written = 0
+        after = None
+        while True:
+            query = {'$or': [{'guild': str(self.guild)}, {'guild': self.guild, 'recipient_id': {'$exists': False}}]}
+            if after is not None:
+                query['_id'] = {'$gt': after}
+            docs = await self.db.find(query).sort('_id', 1).limit(batch).to_list(None)
+            if not docs:
+                return found, written
+            found += len(docs)
+            after = docs[-1]['_id']
+
+            cursor = self.bot.api.logs.find(
+                {'channel_id': {'$in': [str(d['thread_id']) for d in docs]}}, {'_id': 0, 'channel_id': 1, 'recipient': 1}
+            )
+            recipients = {x['channel_id']: x['recipient']['id'] async for x in cursor if x.get('recipient')}
+            requests = []
+            for d in docs:
+                recipient_id = recipients.get(str(d['thread_id']))
+                query = {'_id': d['_id'], 'guild': d['guild'], 'claimers': d.get('claimers', [])}
+                if isinstance(d['guild'], str):
+                    update = {'$set': self.document(d['thread_id'], d.get('claimers', []), recipient_id), '$inc': {'version': 1}}
+                elif recipient_id is not None:
+                    update = {'$set': {'recipient_id': int(recipient_id)}}
+                else:
+                    continue
+                requests.append(UpdateOne(query, update))
+            if requests:
+                written += (await self.db.bulk_write(requests, ordered=False)).modified_count
+            await asyncio.sleep(pause)
+
+    async def get_config(self):
+        return await self.db.find_one({'_id': 'config'}) or {}
+
+    async def update_config(self, update):
+        return await self.db.find_one_and_update(
+            {'_id': 'config'},
+            {**update, '$inc': {'version': 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    # the event log and the rollups keep the ids as strings, like the report reading them
+
+    async def append_events(self, events):
+        await self.db['events'].insert_many([{**event, 'guild': str(self.guild)} for event in events], ordered=False)
+
+    async def add_rollups(self, increments):
+        await self.db['rollups'].bulk_write([
+            UpdateOne(
+                {'_id': f'{self.guild}:{period}:{start}:{claimer_id}'},
+                {
+                    '$inc': dict(counts),
+                    '$setOnInsert': {'guild': str(self.guild), 'period': period, 'start': start, 'claimer_id': claimer_id},
+                },
+                upsert=True
+            )
+            for (period, start, claimer_id), counts in increments.items()
+        ], ordered=False)
+
+    async def rollups(self, period, since):
+        fields = ('_id', 'guild', 'period', 'start', 'claimer_id')
+        cursor = self.db['rollups'].find({'guild': str(self.guild), 'period': period, 'start': {'$gte': since}})
+        return [
+            (x['start'], x['claimer_id'], Counter({k: v for k, v in x.items() if k not in fields}))
+            async for x in cursor
+        ]
+
+    async def watch(self):
+        """Follow the partition's change stream, which needs a replica set"""
+        pipeline = [{'$match': {'operationType': {'$in': ['insert', 'update', 'replace']}}}]
+        async with self.db.collection.watch(pipeline, full_document='updateLookup') as stream:
+            async for change in stream:
+                doc = change.get('fullDocument')
+                if doc is None:
+                    # deleted before the lookup
+                    continue
+                if doc['_id'] == 'config':
+                    yield 'config', 'config', doc.get('version', 0), doc
+                elif str(doc.get('guild')) == str(self.guild) and 'thread_id' in doc:
+                    yield 'thread', str(doc['thread_id']), doc.get('version', 0), [str(c) for c in doc.get('claimers', [])]
+
+    async def query_plans(self, thread_id, claimer_id):
+        queries = [
+            ('Thread lookup', {'thread_id': int(thread_id), 'guild': self.guild}),
+            ('Claims of a member', {'guild': self.guild, 'claimers': int(claimer_id)}),
+            ('Claimed threads of the guild', {'guild': self.guild, 'claimers.0': {'$exists': True}}),
+            ('Guild scan', {'guild': self.guild}),
+        ]
+        plans = []
+        for name, query in queries:
+            explain = await self.db.find(self.filter(query)).explain()
+            plan = explain['queryPlanner']['winningPlan']
+            stages = plan_stages(plan.get('queryPlan', plan))
+            plans.append((
+                name,
+                ' > '.join(f'{stage} `{index}`' if index else stage for stage, index in stages),
+                any(stage == 'COLLSCAN' for stage, _ in stages)
+            ))
+        return plans
+
+
+class SQLiteClaimStore(ClaimStore):
+    """
+    Claims in a local SQLite database in WAL mode, for running the claim state next to the bot
+    Statements run on one thread of their own, a database locked by another process stalls that thread, not the event loop
+    """
+
+    def __init__(self, bot, path):
+        super().__init__(bot)
+        self.path = Path(path)
+        self.conn = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='claim-sqlite')
+        # writes made by the statement running on the database thread, published on the event loop once it's done
+        self.published = []
+
+    async def run(self, fn, *args):
+        """Run fn(*args) on the database thread and publish the writes it made"""
+        result, published = await asyncio.get_running_loop().run_in_executor(self.executor, self.call, fn, args)
+        for change in published:
+            self.publish(*change)
+        return result
+
+    def call(self, fn, args):
+        try:
+            return fn(*args), self.published
+        finally:
+            self.published = []
+
+    async def setup(self):
+        await self.run(self.connect)
+
+    def connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, isolation_level=None, timeout=5)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS threads (
+                guild TEXT NOT NULL, thread_id TEXT NOT NULL, claimers TEXT NOT NULL, version INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (guild, thread_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS claims (
+                guild TEXT NOT NULL, claimer_id TEXT NOT NULL, thread_id TEXT NOT NULL, PRIMARY KEY (guild, claimer_id, thread_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS claims_thread ON claims (guild, thread_id);
+            CREATE TABLE IF NOT EXISTS config (id INTEGER PRIMARY KEY CHECK (id = 0), value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS events (
+                guild TEXT NOT NULL, at REAL NOT NULL, thread_id TEXT NOT NULL, claimer_id TEXT NOT NULL,
+                kind TEXT NOT NULL, wait REAL
+            );
+            CREATE INDEX IF NOT EXISTS events_at ON events (at);
+            CREATE TABLE IF NOT EXISTS rollups (
+                guild TEXT NOT NULL, period TEXT NOT NULL, start TEXT NOT NULL, claimer_id TEXT NOT NULL,
+                field TEXT NOT NULL, value REAL NOT NULL,
+                PRIMARY KEY (guild, period, start, claimer_id, field)
+            ) WITHOUT ROWID;
+        ''')
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(threads)')]
+        if 'version' not in columns:
+            self.conn.execute('ALTER TABLE threads ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        if 'recipient_id' not in columns:
+            self.conn.execute('ALTER TABLE threads ADD COLUMN recipient_id INTEGER')
+        if 'claimed' not in columns:
+            # whether the thread ever had claimers, threads claimed before the column existed are the ones holding some
+            self.conn.execute('ALTER TABLE threads ADD COLUMN claimed INTEGER NOT NULL DEFAULT 0')
+            self.conn.execute("UPDATE threads SET claimed = 1 WHERE claimers != '[]'")
+
+    async def close(self):
+        if self.conn is not None:
+            await self.run(self.conn.close)
+        self.executor.shutdown(wait=False)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # IMMEDIATE takes the write lock up front, so a read-then-write can't interleave with another process
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+    def read(self, thread_id):
+        row = self.conn.execute(
+            'SELECT claimers, version FROM threads WHERE guild = ? AND thread_id = ?', (self.guild, str(thread_id))
+        ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else ([], 0)
+
+    def write(self, thread_id, old, new, version, recipient_id=None):
+        guild, thread_id = self.guild, str(thread_id)
+        self.conn.execute(
+            'INSERT INTO threads (guild, thread_id, claimers, version, recipient_id, claimed) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (guild, thread_id) DO UPDATE SET claimers = excluded.claimers, version = excluded.version, '
+            'recipient_id = COALESCE(excluded.recipient_id, recipient_id), claimed = MAX(claimed, excluded.claimed)',
+            (guild, thread_id, json.dumps(new), version + 1, recipient_id, int(bool(new)))
+        )
+        self.conn.executemany(
+            'DELETE FROM claims WHERE guild = ? AND claimer_id = ? AND thread_id = ?',
+            [(guild, c, thread_id) for c in set(old) - set(new)]
+        )
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO claims (guild, claimer_id, thread_id) VALUES (?, ?, ?)',
+            [(guild, c, thread_id) for c in set(new) - set(old)]
+        )
+        self.published.append(('thread', thread_id, version + 1, list(new)))
+        return version + 1
+
+    async def get(self, thread_id):
+        return await self.run(self.read, thread_id)
+
+    async def compare_and_set(self, thread_id, old, new, recipient_id=None):
+        def compare_and_set():
+            with self.transaction():
+                claimers, version = self.read(thread_id)
+                if claimers != old:
+                    return 0, False
+                claimed = self.conn.execute(
+                    'SELECT claimed FROM threads WHERE guild = ? AND thread_id = ?', (self.guild, str(thread_id))
+                ).fetchone()
+                first = bool(new) and not old and not (claimed and claimed[0])
+                return self.write(thread_id, old, new, version, recipient_id), first
+
+        return await self.run(compare_and_set)
+
+    async def compare_and_set_many(self, changes):
+        def compare_and_set_many():
+            versions = {}
+            with self.transaction():
+                for thread_id, (old, new) in changes.items():
+                    claimers, version = self.read(thread_id)
+                    if claimers == old:
+                        versions[str(thread_id)] = self.write(thread_id, old, new, version)
+            return len(versions), versions
+
+        return await self.run(compare_and_set_many)
+
+    async def pull_claimer(self, claimer_id):
+        def pull_claimer():
+            threads, versions = {}, {}
+            with self.transaction():
+                for thread_id, in self.conn.execute(
+                    'SELECT thread_id FROM claims WHERE guild = ? AND claimer_id = ?', (self.guild, str(claimer_id))
+                ).fetchall():
+                    old, version = self.read(thread_id)
+                    threads[thread_id] = [c for c in old if c != str(claimer_id)]
+                    versions[thread_id] = self.write(thread_id, old, threads[thread_id], version)
+            return threads, versions
+
+        return await self.run(pull_claimer)
+
+    async def delete(self, thread_ids):
+        def delete():
+            threads = {}
+            with self.transaction():
+                for thread_id in map(str, thread_ids):
+                    if claimers := self.read(thread_id)[0]:
+                        threads[thread_id] = claimers
+                    self.conn.execute('DELETE FROM threads WHERE guild = ? AND thread_id = ?', (self.guild, thread_id))
+                    self.conn.execute('DELETE FROM claims WHERE guild = ? AND thread_id = ?', (self.guild, thread_id))
+            return threads
+
+        return await self.run(delete)
+
+    async def claim_counts(self):
+        def claim_counts():
+            rows = self.conn.execute('SELECT claimer_id, COUNT(*) FROM claims WHERE guild = ? GROUP BY claimer_id', (self.guild,))
+            return Counter(dict(rows.fetchall()))
+
+        return await self.run(claim_counts)
+
+    async def threads_of(self, claimer_id):
+        def threads_of():
+            rows = self.conn.execute(
+                'SELECT t.thread_id, t.claimers FROM claims c JOIN threads t ON t.guild = c.guild AND t.thread_id = c.thread_id '
+                'WHERE c.guild = ? AND c.claimer_id = ?', (self.guild, str(claimer_id))
+            )
+            return {thread_id: json.loads(claimers) for thread_id, claimers in rows.fetchall()}
+
+        return await self.run(threads_of)
+
+    async def claims_by_claimer(self):
+        def claims_by_claimer():
+            threads = {}
+            for claimer_id, thread_id in self.conn.execute('SELECT claimer_id, thread_id FROM claims WHERE guild = ?', (self.guild,)):
+                threads.setdefault(claimer_id, []).append(thread_id)
+            return threads
+
+        return await self.run(claims_by_claimer)
+
+    async def claimed(self, thread_ids):
+        def claimed():
+            threads = {}
+            for thread_id in map(str, thread_ids):
+                if claimers := self.read(thread_id)[0]:
+                    threads[thread_id] = claimers
+            return threads
+
+        return await self.run(claimed)
+
+    async def recipients(self, thread_ids):
+        def recipients():
+            recipients = {}
+            for thread_id in map(str, thread_ids):
+                row = self.conn.execute(
+                    'SELECT recipient_id FROM threads WHERE guild = ? AND thread_id = ?', (self.guild, thread_id)
+                ).fetchone()
+                if row and row[0] is not None:
+                    recipients[thread_id] = row[0]
+            return recipients
+
+        return await self.run(recipients)
+
+    async def thread_ids(self, after=None, limit=None):
+        def thread_ids():
+            rows = self.conn.execute(
+                'SELECT thread_id FROM threads WHERE guild = ? AND thread_id > ? ORDER BY thread_id LIMIT ?',
+                (self.guild, after or '', -1 if limit is None else limit)
+            )
+            thread_ids = [thread_id for thread_id, in rows.fetchall()]
+            return thread_ids, thread_ids[-1] if limit is not None and len(thread_ids) == limit else None
+
+        return await self.run(thread_ids)
+
+    def read_config(self):
+        row = self.conn.execute('SELECT value FROM config WHERE id = 0').fetchone()
+        return json.loads(row[0]) if row else {}
+
+    async def get_config(self):
+        return await self.run(self.read_config)
+
+    async def update_config(self, update):
+        def update_config():
+            with self.transaction():
+                config = apply_update(self.read_config(), {**update, '$inc': {'version': 1}})
+                self.conn.execute('INSERT OR REPLACE INTO config (id, value) VALUES (0, ?)', (json.dumps(config),))
+            self.published.append(('config', 'config', config['version'], config))
+            return config
+
+        return await self.run(update_config)
+
+    async def append_events(self, events):
+        def append_events():
+            with self.transaction():
+                self.conn.executemany(
+                    'INSERT INTO events (guild, at, thread_id, claimer_id, kind, wait) VALUES (?, ?, ?, ?, ?, ?)',
+                    [(self.guild, e['at'].timestamp(), e['thread_id'], e['claimer_id'], e['kind'], e.get('wait')) for e in events]
+                )
+                self.conn.execute('DELETE FROM events WHERE at < ?', (time.time() - EVENT_RETENTION,))
+
+        await self.run(append_events)
+
+    async def add_rollups(self, increments):
+        def add_rollups():
+            with self.transaction():
+                self.conn.executemany(
+                    'INSERT INTO rollups (guild, period, start, claimer_id, field, value) VALUES (?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (guild, period, start, claimer_id, field) DO UPDATE SET value = value + excluded.value',
+                    [
+                        (self.guild, period, start, claimer_id, field, value)
+                        for (period, start, claimer_id), counts in increments.items()
+                        for field, value in counts.items()
+                    ]
+                )
+
+        await self.run(add_rollups)
+
+    async def rollups(self, period, since):
+        def rollups():
+            rows = self.conn.execute(
+                'SELECT start, claimer_id, field, value FROM rollups WHERE guild = ? AND period = ? AND start >= ?',
+                (self.guild, period, since)
+            )
+            buckets = {}
+            for start, claimer_id, field, value in rows.fetchall():
+                buckets.setdefault((start, claimer_id), Counter())[field] = value
+            return [(start, claimer_id, counts) for (start, claimer_id), counts in buckets.items()]
+
+        return await self.run(rollups)
+
+    async def query_plans(self, thread_id, claimer_id):
+        queries = [
+            ('Thread lookup', 'SELECT claimers FROM threads WHERE guild = ? AND thread_id = ?', (self.guild, str(thread_id))),
+            ('Claims of a member', 'SELECT thread_id FROM claims WHERE guild = ? AND claimer_id = ?', (self.guild, str(claimer_id))),
+            ('Claim counts', 'SELECT claimer_id, COUNT(*) FROM claims WHERE guild = ? GROUP BY claimer_id', (self.guild,)),
+        ]
+
+        def query_plans():
+            plans = []
+            for name, sql, args in queries:
+                details = [row[-1] for row in self.conn.execute(f'EXPLAIN QUERY PLAN {sql}', args).fetchall()]
+                plans.append((name, ' > '.join(details), any(d.startswith('SCAN') for d in details)))
+            return plans
+
+        return await self.run(query_plans)
+
+
+class MemoryClaimStore(ClaimStore):
+    """Claims in process memory, lost on restart, for tests and benchmarks"""
+
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.threads = {}
+        self.versions = {}
+        # claimer_id -> thread ids they hold
+        self.by_claimer = {}
+        self.recipient_ids = {}
+        # threads that ever had claimers
+        self.claimed = set()
+        self.config = {}
+        # the newest events only, there is no clock-based expiry here
+        self.events = deque(maxlen=100000)
+        self.rollup_counts = {}
+
+    def write(self, thread_id, old, new):
+        self.threads[thread_id] = list(new)
+        if new:
+            self.claimed.add(thread_id)
+        self.versions[thread_id] = self.versions.get(thread_id, 0) + 1
+        for claimer in set(old) - set(new):
+            self.by_claimer[claimer].discard(thread_id)
+        for claimer in set(new) - set(old):
+            self.by_claimer.setdefault(claimer, set()).add(thread_id)
+        self.publish('thread', thread_id, self.versions[thread_id], list(new))
+        return self.versions[thread_id]
+
+    async def get(self, thread_id):
+        return list(self.threads.get(str(thread_id), [])), self.versions.get(str(thread_id), 0)
+
+    async def compare_and_set(self, thread_id, old, new, recipient_id=None):
+        thread_id = str(thread_id)
+        if self.threads.get(thread_id, []) != old:
+            return 0, False
+        if recipient_id is not None:
+            self.recipient_ids[thread_id] = int(recipient_id)
+        first = bool(new) and thread_id not in self.claimed
+        return self.write(thread_id, old, new), first
+
+    async def compare_and_set_many(self, changes):
+        versions = {}
+        for thread_id, (old, new) in changes.items():
+            if version := (await self.compare_and_set(thread_id, old, new))[0]:
+                versions[str(thread_id)] = version
+        return len(versions), versions
+
+    async def pull_claimer(self, claimer_id):
+        threads, versions = {}, {}
+        for thread_id in list(self.by_claimer.get(str(claimer_id), ())):
+            old = self.threads[thread_id]
+            threads[thread_id] = [c for c in old if c != str(claimer_id)]
+            versions[thread_id] = self.write(thread_id, old, threads[thread_id])
+        return threads, versions
+
+    async def delete(self, thread_ids):
+        threads = {}
+        for thread_id in map(str, thread_ids):
+            if thread_id in self.threads:
+                threads[thread_id] = self.threads.pop(thread_id)
+                del self.versions[thread_id]
+                self.recipient_ids.pop(thread_id, None)
+                self.claimed.discard(thread_id)
+                for claimer in threads[thread_id]:
+                    self.by_claimer[claimer].discard(thread_id)
+        return threads
+
+    async def claim_counts(self):
+        return Counter({claimer: len(threads) for claimer, threads in self.by_claimer.items() if threads})
+
+    async def threads_of(self, claimer_id):
+        return {t: list(self.threads[t]) for t in self.by_claimer.get(str(claimer_id), ())}
+
+    async def claims_by_claimer(self):
+        return {claimer: list(threads) for claimer, threads in self.by_claimer.items() if threads}
+
+    async def claimed(self, thread_ids):
+        return {str(t): list(self.threads[str(t)]) for t in thread_ids if self.threads.get(str(t))}
+
+    async def recipients(self, thread_ids):
+        return {str(t): self.recipient_ids[str(t)] for t in thread_ids if str(t) in self.recipient_ids}
+
+    async def thread_ids(self, after=None, limit=None):
+        thread_ids = sorted(t for t in self.threads if t > (after or ''))[:limit]
+        return thread_ids, thread_ids[-1] if limit is not None and len(thread_ids) == limit else None
+
+    async def get_config(self):
+        return dict(self.config)
+
+    async def update_config(self, update):
+        self.config = apply_update(self.config, {**update, '$inc': {'version': 1}})
+        self.publish('config', 'config', self.config['version'], dict(self.config))
+        return dict(self.config)
+
+    async def append_events(self, events):
+        self.events.extend(dict(event) for event in events)
+
+    async def add_rollups(self, increments):
+        for key, counts in increments.items():
+            self.rollup_counts.setdefault(key, Counter()).update(counts)
+
+    async def rollups(self, period, since):
+        return [
+            (start, claimer_id, Counter(counts))
+            for (p, start, claimer_id), counts in self.rollup_counts.items() if p == period and start >= since
+        ]
+
+
+def open_store(bot, cog, metrics):
+    """The claim store picked by the CLAIM_STORE environment variable: mongo (default), sqlite or memory"""
+    kind = os.environ.get('CLAIM_STORE', 'mongo')
+    if kind == 'sqlite':
+        return SQLiteClaimStore(bot, os.environ.get('CLAIM_STORE_PATH') or default_store_path())
+    if kind == 'memory':
+        return MemoryClaimStore(bot)
+    return MongoClaimStore(bot, MeteredCollection(bot.api.get_plugin_partition(cog), metrics))
+
+
+def default_store_path():
+    """
+    Where the SQLite store lives unless CLAIM_STORE_PATH says otherwise, outside the plugin directory an update replaces
+    A database left in the plugin directory by older versions is moved there
+    """
+    path = Path(os.environ.get('XDG_DATA_HOME') or Path.home() / '.local' / 'share') / 'modmail' / 'claims.sqlite3'
+    old = Path(__file__).with_name('claims.sqlite3')
+    if old.exists() and not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        for suffix in ('', '-wal', '-shm'):
+            if old.with_name(old.name + suffix).exists():
+                shutil.move(old.with_name(old.name + suffix), path.with_name(path.name + suffix))
+    return path
+
+
+def apply_update(config, update):
+    """Apply the $set, $inc, $addToSet and $pull updates made to the config document"""
+    config = dict(config)
+    for key, value in update.get('$set', {}).items():
+        config[key] = value
+    for key, value in update.get('$inc', {}).items():
+        config[key] = config.get(key, 0) + value
+    for key, value in update.get('$addToSet', {}).items():
+        values = value['$each'] if isinstance(value, dict) else [value]
+        config[key] = list(dict.fromkeys([*config.get(key, []), *values]))
+    for key, value in update.get('$pull', {}).items():
+        config[key] = [v for v in config.get(key, []) if v != value]
+    return config
+
+
+def legacy_query(query):
+    """The same query for claim documents that store their ids as decimal strings"""
+    if isinstance(query, dict):
+        return {k: legacy_query(v) for k, v in query.items()}
+    if isinstance(query, list):
+        return [legacy_query(v) for v in query]
+    if isinstance(query, int) and not isinstance(query, bool):
+        return str(query)
+    return query
+
+
+def rollup(events):
+    """Add claim events up into hourly and daily counters per claimer, as add_rollups takes them"""
+    increments = {}
+    for event in events:
+        for period, start in (('hour', event['at'].strftime('%Y-%m-%dT%H')), ('day', event['at'].strftime('%Y-%m-%d'))):
+            counts = increments.setdefault((period, start, event['claimer_id']), Counter())
+            counts[event['kind']] += 1
+            if 'wait' in event:
+                minutes = event['wait'] / 60
+                counts[f'wait_{next(b for b in WAIT_BUCKETS if minutes <= b)}'] += 1
+                counts['wait_total'] += event['wait']
+    return increments
+
+
+def median_wait(counts):
+    """The upper bound in minutes of the time to claim bucket holding the median, None without first claims"""
+    histogram = [counts.get(f'wait_{b}', 0) for b in WAIT_BUCKETS]
+    seen = 0
+    for bound, count in zip(WAIT_BUCKETS, histogram):
+        seen += count
+        if count and seen >= sum(histogram) / 2:
+            return bound
+    return None
+
 
 class ClaimThread(commands.Cog):
     """Allows supporters to claim thread by sending claim in the thread channel"""
     def __init__(self, bot):
         self.bot = bot
-        self.db = bot.api.get_plugin_partition(self)
+        self.tracer = Tracer(default_store_path().with_name('claim_trace.jsonl'))
+        self.metrics = Metrics(self.tracer)
+        self.store = MeteredCollection(open_store(bot, self, self.metrics), self.metrics, 'store')
+        # thread_id -> claimers, most recently used last
+        self.cache = OrderedDict()
+        self.cache_size = 10000
+        # thread_id -> store version of the cached claimers, missing if unknown
+        self.cache_versions = {}
+        self.config_version = 0
+        self.invalidations = None
+        # claimer_id -> number of claimed threads, loaded on first use
+        self.claim_counts = None
+        self.claim_counts_lock = asyncio.Lock()
+        # claimer_id -> claims held for writes in flight, so concurrent claims can't all pass the limit
+        self.reserved = Counter()
+        self.claim_config = None
+        # channel fetches in flight at once when resolving uncached threads
+        self.fetch_concurrency = 5
+        # channels younger than this may not have reached the guild cache yet
+        self.cache_grace = timedelta(minutes=5)
+        # last thread_id swept by the reaper, it starts over from the beginning once done
+        self.reaper_position = None
+        self.reaper_batch = 200
+        # deleted channel ids waiting for the debounced flush
+        self.deleted_channels = set()
+        self.delete_flush = None
+        self.delete_window = 2
+        # pending coalesced write of bot.config after subscription changes
+        self.subscriptions_flush = None
+        self.subscriptions_window = 2
+        # recipient notifications waiting for the outbox workers
+        self.outbox = asyncio.Queue(maxsize=1000)
+        self.outbox_workers = []
+        self.outbox_attempts = 5
+        self.outbox_backoff = 1
+        # unclaimed open threads, the heap orders them by channel id, which is creation time
+        # ids that left the set stay in the heap until popped
+        self.waiting = set()
+        self.waiting_heap = []
+        self.waiting_seed = None
+        # idle claim expiry and unclaimed thread alerts
+        self.timers = Timers(self.expire)
+        self.migration = None
+        # claim events waiting for the batched write to the event log and the rollups
+        self.events = []
+        self.events_flush = None
+        self.events_window = 5
+        self.events_batch = 500
+        # thread_id -> claimers of the threads on the claim board, None while there is no board to keep up
+        # the unclaimed threads on it come from the work queue
+        self.board_threads = None
+        self.board_build = None
+        self.board_flush = None
+        self.board_window = 5
         check_reply.fail_msg = 'This thread has been claimed by another user.'
         self.bot.get_command('reply').add_check(check_reply)
         self.bot.get_command('areply').add_check(check_reply)
         self.bot.get_command('fareply').add_check(check_reply)
         self.bot.get_command('freply').add_check(check_reply)
 
-    async def check_claimer(self, ctx, claimer_id):
-        config = await self.db.find_one({'_id': 'config'})
-        if config and 'limit' in config:
-            if config['limit'] == 0:
-                return True
+    async def cog_load(self):
+        await self.store.setup()
+        await self.get_config()
+        self.tracer.start_writer()
+        self.invalidations = asyncio.create_task(self.follow_invalidations())
+        self.outbox_workers = [asyncio.create_task(self.outbox_worker()) for _ in range(3)]
+        self.waiting_seed = asyncio.create_task(self.seed_waiting())
+        self.board_build = asyncio.create_task(self.build_board())
+        self.migration = asyncio.create_task(self.migrate())
+        self.timers.start()
+        self.reaper.start()
+
+    async def cog_unload(self):
+        self.reaper.cancel()
+        self.invalidations.cancel()
+        self.waiting_seed.cancel()
+        self.board_build.cancel()
+        self.migration.cancel()
+        if self.board_flush is not None:
+            self.board_flush.cancel()
+        self.timers.close()
+        try:
+            await asyncio.wait_for(self.outbox.join(), timeout=5)
+        except asyncio.TimeoutError:
+            logger.warning('Dropping %d unsent claim notifications.', self.outbox.qsize())
+        for worker in self.outbox_workers:
+            worker.cancel()
+        if self.subscriptions_flush is not None:
+            self.subscriptions_flush.cancel()
+            self.subscriptions_flush = None
+            try:
+                await self.bot.config.update()
+            except Exception:
+                logger.exception('Failed to save the subscriptions.')
+        if self.delete_flush is not None:
+            self.delete_flush.cancel()
+            self.delete_flush = None
+        if self.deleted_channels:
+            await self.delete_channels(retry=False)
+        if self.events_flush is not None:
+            self.events_flush.cancel()
+            self.events_flush = None
+        await self.write_events()
+        await self.tracer.close()
+        await self.store.close()
+
+    async def cog_before_invoke(self, ctx):
+        ctx.claim_timing = self.metrics.start(
+            f'command.{ctx.command.qualified_name}', thread_id=ctx.channel.id, author=ctx.author.id
+        )
+
+    async def cog_after_invoke(self, ctx):
+        self.metrics.finish(ctx.claim_timing, 'failed' if ctx.command_failed else None)
+
+    def cache_set(self, thread_id, claimers, version):
+        """Store the claimers of a thread unless newer ones are cached, evicting the least recently used threads"""
+        thread_id = str(thread_id)
+        if self.cache_versions.get(thread_id, -1) > version:
+            return
+
+        self.cache[thread_id] = tuple(claimers)
+        self.cache.move_to_end(thread_id)
+        self.cache_versions[thread_id] = version
+        while len(self.cache) > self.cache_size:
+            evicted, _ = self.cache.popitem(last=False)
+            self.cache_versions.pop(evicted, None)
+        # every claimers change passes through here, so it keeps the work queue current too
+        self.track_waiting(thread_id, claimers)
+
+    def cache_drop(self, thread_id):
+        self.cache.pop(str(thread_id), None)
+        self.cache_versions.pop(str(thread_id), None)
+
+    def cache_written(self, thread_id, claimers, version):
+        """
+        Cache claimers we just wrote if the store told their version, otherwise drop the thread
+        Unversioned claimers could be overwritten by a late change feed event for an older write
+        """
+        if version is None:
+            self.cache_drop(thread_id)
+            self.track_waiting(thread_id, claimers)
+        else:
+            self.cache_set(thread_id, claimers, version)
+
+    async def follow_invalidations(self):
+        """
+        Apply the claim and config writes of other bot instances sharing the store
+        Anything not newer than the cached version is ignored, which includes the echo of our own writes
+        """
+        while True:
+            try:
+                async for kind, key, version, value in self.store.collection.watch():
+                    self.invalidate(kind, key, version, value)
+            except OperationFailure as e:
+                logger.warning('The claim store has no change feed, other bot instances can leave the cache stale: %s', e)
+                return
+            except Exception:
+                logger.exception('Lost the claim change feed, starting over with an empty cache.')
+
+            # writes made while the feed was down were missed
+            self.cache.clear()
+            self.cache_versions.clear()
+            self.claim_counts = None
+            await asyncio.sleep(5)
+
+    def invalidate(self, kind, key, version, value):
+        self.metrics.count(f'invalidation.{kind}')
+        if kind == 'config':
+            if version > self.config_version:
+                self.set_config(value)
+            return
+
+        if version <= self.cache_versions.get(key, 0):
+            return
+        # somebody else wrote, the counts follow if we know what the claimers were right before
+        if key in self.cache and self.cache_versions.get(key) == version - 1:
+            self.count_claims(removed=self.cache[key], added=value)
+        else:
+            self.claim_counts = None
+        self.cache_set(key, value, version)
+
+    async def migrate(self):
+        """Convert claims stored by older versions in the background, an interrupted run carries on at the next load"""
+        await self.bot.wait_until_ready()
+        try:
+            count = await self.store.migrate()
+        except Exception:
+            logger.exception('Failed to migrate the stored claims, retrying at the next load.')
+            return
+        if count:
+            logger.info('Migrated %d stored claims to the compact format.', count)
+
+    def track_waiting(self, thread_id, claimers):
+        """Queue a thread for claim next if nobody holds it, or take it off the queue"""
+        thread_id = str(thread_id)
+        config = self.claim_config
+        if self.board_threads is not None and self.board_threads.get(thread_id) != tuple(claimers):
+            self.board_threads[thread_id] = tuple(claimers)
+            self.update_board()
+        if claimers:
+            self.waiting.discard(thread_id)
+            self.timers.cancel(('sla', thread_id))
+            if config.idle and not self.timers.armed(('idle', thread_id)):
+                self.timers.arm(('idle', thread_id), config.idle * 60)
+        else:
+            self.timers.cancel(('idle', thread_id))
+            if thread_id not in self.waiting:
+                self.waiting.add(thread_id)
+                heapq.heappush(self.waiting_heap, int(thread_id))
+                if len(self.waiting_heap) > 2 * len(self.waiting) + 100:
+                    self.waiting_heap = sorted(int(t) for t in self.waiting)
+                if config.sla:
+                    self.timers.arm(('sla', thread_id), config.sla * 60)
+
+    def forget_thread(self, thread_id):
+        """Drop a closed or deleted thread from the work queue and its timers"""
+        thread_id = str(thread_id)
+        self.waiting.discard(thread_id)
+        self.timers.cancel(('idle', thread_id))
+        self.timers.cancel(('sla', thread_id))
+        if self.board_threads is not None:
+            self.board_threads.pop(thread_id, None)
+            self.update_board()
+
+    def pop_waiting(self):
+        """Take the longest waiting unclaimed thread off the queue, returns None if there is none"""
+        while self.waiting_heap:
+            thread_id = heapq.heappop(self.waiting_heap)
+            if str(thread_id) in self.waiting:
+                self.waiting.remove(str(thread_id))
+                return thread_id
+        return None
+
+    async def seed_waiting(self):
+        """
+        Queue the open threads nobody has claimed yet and arm the timers of every open thread
+        The open threads are found through the open logs of this bot
+        """
+        await self.bot.wait_until_ready()
+        logs = MeteredCollection(self.bot.api.logs, self.metrics, 'logs')
+        cursor = logs.find({'open': True, 'bot_id': str(self.bot.user.id)}, {'_id': 0, 'channel_id': 1})
+        open_ids = [x['channel_id'] async for x in cursor]
+        claimed = await self.store.claimed(open_ids)
+        config = await self.get_config()
+        now = discord.utils.utcnow()
+        for thread_id in open_ids:
+            # threads touched while seeding have fresher claimers in the cache
+            claimers = self.cache.get(thread_id, claimed.get(thread_id, []))
+            armed = self.timers.armed(('sla', thread_id))
+            self.track_waiting(thread_id, claimers)
+            if not claimers and config.sla and not armed:
+                # a thread found waiting has been since it opened, as far as we can tell after a restart
+                age = (now - discord.utils.snowflake_time(int(thread_id))).total_seconds()
+                self.timers.arm(('sla', thread_id), config.sla * 60, elapsed=max(0, age))
+
+    async def get_claimers(self, thread_id):
+        """Get the claimers of a thread from the cache, loading them on a miss"""
+        thread_id = str(thread_id)
+        if thread_id in self.cache:
+            self.metrics.count('cache.hit')
+            self.cache.move_to_end(thread_id)
+            return self.cache[thread_id]
+
+        self.metrics.count('cache.miss')
+        claimers, version = await self.store.get(thread_id)
+        self.cache_set(thread_id, claimers, version)
+        return self.cache[thread_id]
+
+    async def load_claim_counts(self):
+        """Build the per-claimer thread counts with a single query, once"""
+        if self.claim_counts is not None:
+            return
+
+        async with self.claim_counts_lock:
+            if self.claim_counts is None:
+                self.claim_counts = await self.store.claim_counts()
+
+    def count_claims(self, removed=(), added=()):
+        """Adjust the per-claimer thread counts after a claimers change"""
+        if self.claim_counts is None:
+            return
+
+        for claimer in removed:
+            self.claim_counts[claimer] -= 1
+            if self.claim_counts[claimer] <= 0:
+                del self.claim_counts[claimer]
+        for claimer in added:
+            self.claim_counts[claimer] += 1
+
+    async def change_claimers(self, thread_id, change, recipient_id=None):
+        """
+        Write change(claimers) with a compare-and-set, starting over with fresh claimers when another write got in first
+        change returns the new claimers, or None if there is nothing to do
+        recipient_id: stored with the claimers when given
+        Returns the claimers before and after the write, or None if nothing was written
+        """
+        await self.load_claim_counts()
+        thread_id = str(thread_id)
+        # on a cache miss guess no claimers, most threads written to for the first time have none
+        known = thread_id in self.cache
+        old = list(self.cache.get(thread_id, ()))
+        while True:
+            new = change(old)
+            if new is None and known:
+                return None
+            if new is not None:
+                version, first = await self.store.compare_and_set(thread_id, old, new, recipient_id)
+                if version:
+                    self.count_claims(removed=old, added=new)
+                    self.cache_set(thread_id, new, version)
+                    self.record_events(thread_id, old, new, first)
+                    return old, new
+
+            self.metrics.count('store.conflict')
+            old, version = await self.store.get(thread_id)
+            known = True
+            self.cache_set(thread_id, old, version)
+
+    async def claim_thread(self, thread_id, claimer_id, recipient_id=None):
+        """Claim a thread nobody holds, returns the change if this claim won"""
+        return await self.change_claimers(thread_id, lambda claimers: None if claimers else [str(claimer_id)], recipient_id)
+
+    async def add_claimer(self, thread_id, claimer_id, required=None):
+        """
+        Add a claimer to a thread, returns the change if they were not in claimers yet
+        required: only add if this member is already a claimer
+        """
+        def change(claimers):
+            if str(claimer_id) in claimers or required is not None and str(required) not in claimers:
+                return None
+            return claimers + [str(claimer_id)]
+
+        return await self.change_claimers(thread_id, change)
+
+    async def add_claimers(self, thread_id, claimer_ids):
+        """Add several claimers to a thread in one write, returns the ones that were added"""
+        claimer_ids = list(dict.fromkeys(str(c) for c in claimer_ids))
+
+        def change(claimers):
+            added = [c for c in claimer_ids if c not in claimers]
+            return claimers + added if added else None
+
+        written = await self.change_claimers(thread_id, change)
+        return [c for c in written[1] if c not in written[0]] if written else []
+
+    async def remove_claimer(self, thread_id, claimer_id, required=None):
+        """
+        Remove a claimer from a thread, returns the change if they were in claimers
+        required: only remove if this member is a claimer too
+        """
+        def change(claimers):
+            if str(claimer_id) not in claimers or required is not None and str(required) not in claimers:
+                return None
+            return [c for c in claimers if c != str(claimer_id)]
+
+        return await self.change_claimers(thread_id, change)
+
+    async def remove_claimers(self, thread_id, claimer_ids):
+        """Remove several claimers from a thread in one write, returns the ones that were removed"""
+        claimer_ids = [str(c) for c in claimer_ids]
+
+        def change(claimers):
+            kept = [c for c in claimers if c not in claimer_ids]
+            return kept if len(kept) < len(claimers) else None
+
+        written = await self.change_claimers(thread_id, change)
+        return [c for c in written[0] if c not in written[1]] if written else []
+
+    async def set_claimers(self, thread_id, claimers, required=None):
+        """
+        Replace the claimers of a thread, returns the change
+        required: only replace if this member is a claimer
+        """
+        def change(old):
+            if required is not None and str(required) not in old:
+                return None
+            return list(claimers)
+
+        return await self.change_claimers(thread_id, change)
+
+    async def replace_claimers(self, changes):
+        """
+        Replace the claimers of many threads in one store write, returns how many threads were written
+        changes: thread_id -> (claimers as read, new claimers), a thread is only written if its claimers are unchanged
+        """
+        if not changes:
+            return 0
+
+        await self.load_claim_counts()
+        written, versions = await self.store.compare_and_set_many(changes)
+        if written == len(changes):
+            for thread_id, (old, new) in changes.items():
+                self.count_claims(removed=old, added=new)
+                self.cache_written(thread_id, new, versions.get(str(thread_id)))
+                self.record_events(thread_id, old, new)
         else:
+            # some threads changed after they were read, recount rather than guess which
+            # their events are lost too, the store can't tell which writes went through
+            self.metrics.count('events.unrecorded', len(changes))
+            self.claim_counts = None
+            for thread_id in changes:
+                self.cache_drop(thread_id)
+        return written
+
+    async def release_claimer(self, claimer_id):
+        """
+        Remove a member from the claimers of every thread in one store operation
+        Returns the claimers each of their threads is left with
+        """
+        await self.load_claim_counts()
+        claimer_id = str(claimer_id)
+        threads, versions = await self.store.pull_claimer(claimer_id)
+
+        # they hold nothing anymore, including threads claimed between the read and the update
+        # the counts may have been reset by an invalidation meanwhile
+        if self.claim_counts is not None:
+            self.claim_counts.pop(claimer_id, None)
+        for thread_id, claimers in list(self.cache.items()):
+            if claimer_id in claimers:
+                self.cache_written(thread_id, [c for c in claimers if c != claimer_id], versions.get(thread_id))
+        for thread_id, claimers in threads.items():
+            self.track_waiting(thread_id, claimers)
+            self.record_events(thread_id, claimers + [claimer_id], claimers)
+        return threads
+
+    async def delete_threads(self, thread_ids):
+        """Forget many threads in one store operation, returns how many were stored"""
+        if not thread_ids:
+            return 0
+
+        await self.load_claim_counts()
+        threads = await self.store.delete(thread_ids)
+        self.count_claims(removed=[c for claimers in threads.values() for c in claimers])
+        for thread_id in thread_ids:
+            self.cache_drop(thread_id)
+            self.forget_thread(thread_id)
+        return len(threads)
+
+    def record_events(self, thread_id, old, new, first=False):
+        """
+        Queue the claim events of a claimers change for the event log
+        claim: a member took a thread nobody had claimed before, with the seconds since the thread opened
+        reclaim: a member took a thread that was unclaimed again, after an unclaim, expiry or release
+        join and leave: a member was added to or removed from the claimers
+        first: whether the store saw this write give the thread its first claimers
+        """
+        now = discord.utils.utcnow()
+        for claimer_id in new:
+            if claimer_id not in old:
+                event = {'at': now, 'thread_id': str(thread_id), 'claimer_id': claimer_id, 'kind': 'join'}
+                if not old and first:
+                    event['kind'] = 'claim'
+                    event['wait'] = (now - discord.utils.snowflake_time(int(thread_id))).total_seconds()
+                elif not old:
+                    event['kind'] = 'reclaim'
+                self.events.append(event)
+        for claimer_id in old:
+            if claimer_id not in new:
+                self.events.append({'at': now, 'thread_id': str(thread_id), 'claimer_id': claimer_id, 'kind': 'leave'})
+
+        # a full batch doesn't wait out the window, a pending flush is still sleeping so it is safe to cancel
+        full = len(self.events) >= self.events_batch
+        if full and self.events_flush is not None:
+            self.events_flush.cancel()
+            self.events_flush = None
+        if self.events and self.events_flush is None:
+            self.events_flush = asyncio.create_task(self.flush_events(0 if full else self.events_window))
+
+    async def flush_events(self, delay):
+        await asyncio.sleep(delay)
+        self.events_flush = None
+        await self.write_events()
+
+    @metered('task.write_events')
+    async def write_events(self):
+        """Append the queued events to the event log and add them to the rollups, two writes per batch"""
+        events, self.events = self.events, []
+        if not events:
+            return
+
+        try:
+            await self.store.append_events(events)
+            await self.store.add_rollups(rollup(events))
+        except Exception:
+            self.metrics.count('events.unrecorded', len(events))
+            logger.exception('Failed to record %d claim events.', len(events))
+
+    async def build_board(self):
+        """
+        Load who holds what with a single aggregation and draw the claim board, if there is one
+        Claimers changed while the aggregation runs are already on the board and win over its result
+        """
+        await self.bot.wait_until_ready()
+        if (await self.get_config()).board is None:
+            return
+
+        self.board_threads = {}
+        threads = {}
+        for claimer_id, thread_ids in (await self.store.claims_by_claimer()).items():
+            for thread_id in thread_ids:
+                threads.setdefault(thread_id, []).append(claimer_id)
+        for thread_id, claimers in threads.items():
+            self.board_threads.setdefault(thread_id, tuple(claimers))
+        await self.draw_board()
+
+    def update_board(self):
+        """Schedule an edit of the claim board, every change within the window is drawn by the same edit"""
+        if self.board_flush is None:
+            self.board_flush = asyncio.create_task(self.flush_board())
+
+    async def flush_board(self):
+        await asyncio.sleep(self.board_window)
+        self.board_flush = None
+        await self.draw_board()
+
+    @metered('task.draw_board')
+    async def draw_board(self):
+        """Edit the claim board message in place, turning the board off if the message is gone"""
+        board = (await self.get_config()).board
+        if board is None or self.board_threads is None:
+            return
+
+        channel = self.bot.get_channel(board[0])
+        try:
+            if channel is None:
+                raise LookupError
+            await self.metrics.timed(
+                'discord.edit_board', channel.get_partial_message(board[1]).edit(content=None, embed=self.board_embed())
+            )
+        except (LookupError, discord.NotFound):
+            logger.warning('The claim board message was deleted, turning the board off.')
+            self.board_threads = None
+            await self.update_config({'$set': {'board': None}})
+        except discord.HTTPException:
+            logger.exception('Failed to update the claim board.')
+
+    def board_embed(self):
+        """Every open thread grouped by claimer with how long ago it opened, then the unclaimed ones, oldest first"""
+        guild = self.bot.modmail_guild
+        by_claimer = {}
+        for thread_id, claimers in self.board_threads.items():
+            if claimers and guild.get_channel(int(thread_id)) is not None:
+                for claimer_id in claimers:
+                    by_claimer.setdefault(claimer_id, []).append(int(thread_id))
+        unclaimed = sorted(int(t) for t in self.waiting if guild.get_channel(int(t)) is not None)
+
+        def line(thread_id):
+            # discord renders relative timestamps itself, so the ages stay current without edits
+            return f'<#{thread_id}> <t:{int(discord.utils.snowflake_time(thread_id).timestamp())}:R>'
+
+        lines = []
+        for claimer_id, thread_ids in sorted(by_claimer.items(), key=lambda x: (-len(x[1]), x[0])):
+            lines.append(f'**<@{claimer_id}>** ({len(thread_ids)})')
+            lines += [line(t) for t in sorted(thread_ids)]
+        if unclaimed:
+            lines.append(f'**Unclaimed** ({len(unclaimed)})')
+            lines += [line(t) for t in unclaimed]
+
+        pages = paginate(lines, limit=4000, separator='\n')
+        embed = discord.Embed(title='Claim board', color=self.bot.main_color, timestamp=discord.utils.utcnow())
+        embed.description = pages[0] or 'No open threads'
+        embed.set_footer(text='Too many threads to show them all, updated' if len(pages) > 1 else 'Updated')
+        return embed
+
+    def set_config(self, config):
+        """Swap in a new config snapshot built from the config document"""
+        config = config or {}
+        self.claim_config = ClaimConfig(
+            config.get('limit'),
+            frozenset(config.get('bypass_roles', [])),
+            config.get('reaper', False),
+            config.get('trace', False),
+            config.get('idle', 0),
+            config.get('sla', 0),
+            config.get('board')
+        )
+        self.tracer.enabled = self.claim_config.trace
+        self.config_version = config.get('version', 0)
+        return self.claim_config
+
+    async def get_config(self):
+        """Get the config snapshot, reading the config document only the first time"""
+        if self.claim_config is None:
+            return self.set_config(await self.store.get_config())
+        return self.claim_config
+
+    async def update_config(self, update):
+        """Update the config document and swap in the resulting snapshot"""
+        return self.set_config(await self.store.update_config(update))
+
+    async def resolve_channels(self, guild, thread_ids):
+        """
+        Resolve thread ids to channels, fetching cache misses a few at a time
+        Returns the channels found by thread id and the ids of deleted channels
+        """
+        channels = {}
+        missing = []
+        for thread_id in thread_ids:
+            if channel := guild.get_channel(int(thread_id)):
+                channels[thread_id] = channel
+            else:
+                missing.append(thread_id)
+
+        semaphore = asyncio.Semaphore(self.fetch_concurrency)
+        deleted = []
+
+        async def fetch(thread_id):
+            async with semaphore:
+                try:
+                    channels[thread_id] = await self.metrics.timed(
+                        'discord.fetch_channel', self.bot.fetch_channel(int(thread_id))
+                    )
+                except discord.NotFound:
+                    deleted.append(thread_id)
+
+        await asyncio.gather(*(fetch(thread_id) for thread_id in missing))
+        return channels, deleted
+
+    async def find_deleted_threads(self, guild, thread_ids):
+        """
+        Find the thread ids whose channel no longer exists
+        Anything missing from the guild's cached channels is gone, unless it is too new to trust the cache for,
+        only those are checked against the API
+        """
+        missing = set(thread_ids) - {str(c.id) for c in guild.channels}
+        recent = discord.utils.utcnow() - self.cache_grace
+        unsure = [t for t in missing if discord.utils.snowflake_time(int(t)) > recent]
+        _, deleted = await self.resolve_channels(guild, unsure)
+        return missing.difference(unsure).union(deleted)
+
+    @tasks.loop(minutes=1)
+    @metered('task.reaper')
+    async def reaper(self):
+        """Sweep one batch of stored threads for deleted channels, resuming after the last batch"""
+        if not (await self.get_config()).reaper or self.bot.modmail_guild is None:
+            return
+
+        thread_ids, self.reaper_position = await self.store.thread_ids(self.reaper_position, self.reaper_batch)
+
+        count = await self.delete_threads(await self.find_deleted_threads(self.bot.modmail_guild, thread_ids))
+        if count:
+            logger.info('Reaper cleaned up %d closed tickets records.', count)
+
+    @reaper.before_loop
+    async def before_reaper(self):
+        await self.bot.wait_until_ready()
+
+    @metered('check.check_claimer')
+    async def check_claimer(self, ctx, claimer_id, count=1):
+        """Whether a member can claim count more threads, counting the claims held by writes in flight"""
+        config = await self.get_config()
+        if config.limit is None:
             raise commands.BadArgument(f"Set Limit first. `{ctx.prefix}claim limit`")
+        if config.limit == 0:
+            return True
+
+        await self.load_claim_counts()
+        claimer_id = str(claimer_id)
+        return self.claim_counts[claimer_id] + self.reserved[claimer_id] + count <= config.limit
+
+    @contextlib.asynccontextmanager
+    async def reserve_claims(self, ctx, claimer_id, count=1):
+        """
+        Hold count claims of a member against the limit while the writes inside run, yields whether they fit
+        The hold is taken right after the check with no await in between and released on the way out,
+        by then a successful write has added its claims to the counts
+        """
+        claimer_id = str(claimer_id)
+        allowed = await self.check_claimer(ctx, claimer_id, count)
+        held = count if allowed and self.claim_config.limit else 0
+        self.reserved[claimer_id] += held
+        try:
+            yield allowed
+        finally:
+            self.reserved[claimer_id] -= held
+            if self.reserved[claimer_id] <= 0:
+                del self.reserved[claimer_id]
+
+    @metered('listener.on_guild_channel_delete')
+    async def flush_deleted_channels(self):
+        """Wait out the debounce window, then delete the collected threads with a single delete_many"""
+        await asyncio.sleep(self.delete_window)
+        self.delete_flush = None
+        await self.delete_channels()
+
+    async def delete_channels(self, retry=True):
+        """
+        Delete the threads of the collected channels, channels that aren't threads match no stored thread
+        A failed delete is retried next window
+        """
+        channel_ids, self.deleted_channels = self.deleted_channels, set()
+        try:
+            await self.delete_threads(channel_ids)
+        except Exception:
+            logger.exception('Failed to delete the threads of %d deleted channels.', len(channel_ids))
+            if retry:
+                self.deleted_channels |= channel_ids
+                if self.delete_flush is None:
+                    self.delete_flush = asyncio.create_task(self.flush_deleted_channels())
+
+    def save_subscriptions(self):
+        """
+        Schedule a write of bot.config after changing subscriptions
+        Every change within the window is saved by the same config update
+        """
+        if self.subscriptions_flush is None:
+            self.subscriptions_flush = asyncio.create_task(self.flush_subscriptions())
+
+    async def flush_subscriptions(self):
+        await asyncio.sleep(self.subscriptions_window)
+        # changes made while the update is in flight schedule another one
+        self.subscriptions_flush = None
+        try:
+            await self.metrics.timed('config.update', self.bot.config.update())
+        except Exception:
+            # bot.config still holds the changes, the next flush writes them
+            logger.exception('Failed to save the subscriptions, retrying.')
+            self.save_subscriptions()
+
+    def notify_recipient(self, recipient_id, embed):
+        """Queue a DM to a thread recipient, the outbox workers send it in the background"""
+        try:
+            self.outbox.put_nowait((recipient_id, embed))
+        except asyncio.QueueFull:
+            self.metrics.count('outbox.dropped')
+            logger.warning('Claim notification outbox is full, not notifying %s.', recipient_id)
+
+    async def outbox_worker(self):
+        while True:
+            recipient_id, embed = await self.outbox.get()
+            try:
+                await self.deliver(recipient_id, embed)
+            except Exception:
+                self.metrics.count('outbox.failed')
+                logger.exception('Failed to notify %s of their claimed thread.', recipient_id)
+            finally:
+                self.outbox.task_done()
+
+    async def deliver(self, recipient_id, embed):
+        """Send one DM, retrying rate limits and Discord errors with exponential backoff"""
+        for attempt in range(self.outbox_attempts):
+            try:
+                recipient = self.bot.get_user(recipient_id) or await self.metrics.timed(
+                    'discord.fetch_user', self.bot.fetch_user(recipient_id)
+                )
+                await self.metrics.timed('discord.send_dm', recipient.send(embed=embed))
+                self.metrics.count('outbox.sent')
+                return
+            except (discord.Forbidden, discord.NotFound):
+                # DMs closed or the user is gone, retrying won't change that
+                self.metrics.count('outbox.skipped')
+                return
+            except discord.HTTPException as e:
+                if e.status != 429 and e.status < 500 or attempt == self.outbox_attempts - 1:
+                    raise
+                retry_after = getattr(e.response, 'headers', {}).get('Retry-After') if e.status == 429 else None
+                delay = float(retry_after) if retry_after else self.outbox_backoff * 2 ** attempt + random.random()
+
+            self.metrics.count('outbox.retried')
+            await asyncio.sleep(delay)
+
+    def is_supporter(self, member):
+        """Whether a member still has at least the supporter permission level, the way core.checks decides it"""
+        if member.id in self.bot.bot_owner_ids or member.guild_permissions.administrator:
+            return True
+
+        level_permissions = self.bot.config['level_permissions']
+        ids = {str(member.id)}.union(str(r.id) for r in member.roles)
+        for level in PermissionLevel:
+            if level >= PermissionLevel.SUPPORTER and level.name in level_permissions:
+                # -1 is for @everyone
+                if -1 in level_permissions[level.name] or not ids.isdisjoint(level_permissions[level.name]):
+                    return True
+        return False
+
+    async def release_member(self, member):
+        """Release every claim of a member and unsubscribe them from those threads, returns what release_claimer does"""
+        threads = await self.release_claimer(member.id)
+        recipients = await self.store.recipients(threads)
+        subscriptions = self.bot.config['subscriptions']
+        for thread_id in threads:
+            # subscriptions are keyed by the recipient id, threads claimed before it was stored have it in the topic
+            recipient_id = recipients.get(thread_id)
+            if recipient_id is None and (channel := self.bot.modmail_guild.get_channel(int(thread_id))):
+                recipient_id = match_user_id(channel.topic)
+            mentions = subscriptions.get(str(recipient_id), []) if recipient_id is not None else []
+            if member.mention in mentions:
+                mentions.remove(member.mention)
+                self.save_subscriptions()
+        return threads
+
+    def release_embed(self, member, threads, reason):
+        embed = discord.Embed(title='Claims released', color=self.bot.main_color)
+        embed.description = f'Released {len(threads)} claimed threads of {member.mention} ({reason})'
+        if unclaimed := [f'<#{t}>' for t, claimers in threads.items() if not claimers]:
+            embed.add_field(name='Now unclaimed', value=paginate(unclaimed, limit=1024)[0], inline=False)
+        return embed
+
+    @metered('listener.release_departed')
+    async def release_departed(self, member, reason):
+        """Release the claims of a member who can't answer threads anymore and report it to the log channel"""
+        await self.load_claim_counts()
+        if not self.claim_counts[str(member.id)]:
+            return
 
-        cursor = self.db.find({'guild':str(self.bot.modmail_guild.id)})
-        count = 0
-        async for x in cursor:
-            if 'claimers' in x and str(claimer_id) in x['claimers']:
-                count += 1
+        threads = await self.release_member(member)
+        logger.info('Released %d claims of %s (%s).', len(threads), member, reason)
+        if threads and self.bot.log_channel is not None:
+            await self.bot.log_channel.send(embed=self.release_embed(member, threads, reason))
 
-        return count < config['limit']
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        if member.guild == self.bot.modmail_guild:
+            await self.release_departed(member, 'left the server')
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        if after.guild != self.bot.modmail_guild or set(before.roles) <= set(after.roles):
+            return
+        if not self.is_supporter(after):
+            await self.release_departed(after, 'lost their supporter role')
+
+    @commands.Cog.listener()
+    async def on_thread_ready(self, thread, *args):
+        self.track_waiting(thread.channel.id, await self.get_claimers(thread.channel.id))
+
+    @commands.Cog.listener()
+    async def on_thread_close(self, thread, *args):
+        self.forget_thread(thread.channel.id)
+
+    @commands.Cog.listener()
+    async def on_thread_reply(self, thread, from_mod, message, *args):
+        idle = (await self.get_config()).idle
+        if idle and str(message.author.id) in await self.get_claimers(thread.channel.id):
+            self.timers.arm(('idle', str(thread.channel.id)), idle * 60)
 
-    async def check_before_update(self, channel):
-        if channel.guild != self.bot.modmail_guild or await self.bot.api.get_log(channel.id) is None:
-            return False
+    @metered('task.expire')
+    async def expire(self, kind, thread_id):
+        """Unclaim a thread whose claimers went idle, or alert that a thread has waited unclaimed too long"""
+        config = await self.get_config()
+        channel = self.bot.modmail_guild.get_channel(int(thread_id))
+        if channel is None:
+            return
 
-        return True
+        if kind == 'idle' and config.idle:
+            claimers = await self.get_claimers(thread_id)
+            if claimers and await self.replace_claimers({thread_id: (list(claimers), [])}):
+                embed = discord.Embed(color=self.bot.main_color)
+                embed.description = f'Unclaimed after {config.idle} minutes without a reply from the claimers'
+                await channel.send(embed=embed)
+        elif kind == 'sla' and config.sla and thread_id in self.waiting:
+            if self.bot.log_channel is not None:
+                embed = discord.Embed(color=discord.Color.orange())
+                embed.description = f'{channel.mention} has waited unclaimed for over {config.sla} minutes'
+                await self.bot.log_channel.send(embed=embed)
 
     @commands.Cog.listener()
     async def on_guild_channel_delete(self, channel):
-        if await self.check_before_update(channel):
-            await self.db.delete_one({'thread_id': str(channel.id), 'guild': str(self.bot.modmail_guild.id)})
+        if channel.guild != self.bot.modmail_guild:
+            return
+
+        self.deleted_channels.add(str(channel.id))
+        if self.delete_flush is None:
+            self.delete_flush = asyncio.create_task(self.flush_deleted_channels())
 
     @checks.has_permissions(PermissionLevel.SUPPORTER)
     @checks.thread_only()
@@ -54,21 +2178,13 @@ class ClaimThread(commands.Cog):
     async def claim_(self, ctx, subscribe: bool = True):
         """Claim a thread"""
         if not ctx.invoked_subcommand:
-            if not await self.check_claimer(ctx, ctx.author.id):
-                return await ctx.reply(f"Limit reached, can't claim the thread.")
-
-            thread = await self.db.find_one({'thread_id': str(ctx.thread.channel.id), 'guild': str(self.bot.modmail_guild.id)})
-            recipient_id = match_user_id(ctx.thread.channel.topic)
-            recipient = self.bot.get_user(recipient_id) or await self.bot.fetch_user(recipient_id)
-
-            embed = discord.Embed(
-                color=self.bot.main_color,
-                title="Ticket Claimed",
-                description="Please wait as the assigned support agent reviews your case, you will receive a response shortly.",
-                timestamp=ctx.message.created_at,
-            )
-            embed.set_footer(
-                text=f"{ctx.author.name}#{ctx.author.discriminator}", icon_url=ctx.author.display_avatar.url)
+            async with self.reserve_claims(ctx, ctx.author.id) as allowed:
+                if not allowed:
+                    return await ctx.reply("Limit reached, can't claim the thread.")
+
+                # a thread's id is its recipient's
+                thread = await self.claim_thread(ctx.thread.channel.id, ctx.author.id, ctx.thread.id)
+            embed = self.claimed_embed(ctx)
 
             description = ""
             if subscribe:
@@ -83,60 +2199,82 @@ class ClaimThread(commands.Cog):
                 else:
                     mentions.append(ctx.author.mention)
                     description += f"{ctx.author.mention} will now be notified of all messages received.\n"
-                await self.bot.config.update()
+                self.save_subscriptions()
 
-            if thread is None:
-                await self.db.insert_one({'thread_id': str(ctx.thread.channel.id), 'guild': str(self.bot.modmail_guild.id), 'claimers': [str(ctx.author.id)]})
-                async with ctx.typing():
-                    await recipient.send(embed=embed)
-                description += "Please respond to the case asap."
-                embed.description = description
-                await ctx.reply(embed=embed)
-            elif thread and len(thread['claimers']) == 0:
-                await self.db.find_one_and_update({'thread_id': str(ctx.thread.channel.id), 'guild': str(self.bot.modmail_guild.id)}, {'$addToSet': {'claimers': str(ctx.author.id)}})
-                async with ctx.typing():
-                    await recipient.send(embed=embed)
+            if thread is not None:
+                self.notify_recipient(ctx.thread.id, embed.copy())
                 description += "Please respond to the case asap."
                 embed.description = description
-                await ctx.reply(embed=embed)
+                await self.metrics.timed('discord.reply', ctx.reply(embed=embed))
             else:
                 description += "Thread is already claimed"
                 embed.description = description
-                await ctx.reply(embed=embed)
+                await self.metrics.timed('discord.reply', ctx.reply(embed=embed))
+
+    def claimed_embed(self, ctx):
+        """The embed telling a recipient their thread was claimed"""
+        embed = discord.Embed(
+            color=self.bot.main_color,
+            title="Ticket Claimed",
+            description="Please wait as the assigned support agent reviews your case, you will receive a response shortly.",
+            timestamp=ctx.message.created_at,
+        )
+        embed.set_footer(
+            text=f"{ctx.author.name}#{ctx.author.discriminator}", icon_url=ctx.author.display_avatar.url)
+        return embed
+
+    @checks.has_permissions(PermissionLevel.SUPPORTER)
+    @commands.guild_only()
+    @claim_.command(name='next')
+    async def claim_next(self, ctx):
+        """Claim the unclaimed thread that has been waiting the longest"""
+        async with self.reserve_claims(ctx, ctx.author.id) as allowed:
+            if not allowed:
+                return await ctx.reply("Limit reached, can't claim the thread.")
+
+            while (thread_id := self.pop_waiting()) is not None:
+                channel = self.bot.modmail_guild.get_channel(thread_id)
+                # skip threads closed behind our back and ones claimed since they were queued
+                if channel is None or (thread := await self.bot.threads.find(channel=channel)) is None:
+                    continue
+                # a thread's id is its recipient's
+                if await self.claim_thread(thread_id, ctx.author.id, thread.id) is not None:
+                    break
+            else:
+                return await ctx.reply('No unclaimed threads are waiting.')
+
+        mentions = self.bot.config["subscriptions"].setdefault(str(thread.id), [])
+        if ctx.author.mention not in mentions:
+            mentions.append(ctx.author.mention)
+            self.save_subscriptions()
+
+        self.notify_recipient(thread.id, self.claimed_embed(ctx))
+        waited = discord.utils.utcnow() - discord.utils.snowflake_time(thread_id)
+        await ctx.reply(f'You claimed {channel.mention}, it waited {int(waited.total_seconds() // 60)} minutes.')
 
     @checks.has_permissions(PermissionLevel.SUPPORTER)
     @commands.command()
     async def claims(self, ctx):
         """Check which channels you have clamined"""
-        cursor = self.db.find({'guild':str(self.bot.modmail_guild.id)})
-        channels = []
-        async for x in cursor:
-            if 'claimers' in x and str(ctx.author.id) in x['claimers']:
-                try:
-                    channel = ctx.guild.get_channel(int(x['thread_id'])) or await self.bot.fetch_channel(int(x['thread_id']))
-                except discord.NotFound:
-                    channel = None
-                    await self.db.delete_one({'thread_id': x['thread_id'], 'guild': x['guild']})
+        thread_ids = list(await self.store.threads_of(ctx.author.id))
+        channels, deleted = await self.resolve_channels(ctx.guild, thread_ids)
+        await self.delete_threads(deleted)
 
-                if channel and channel not in channels:
-                    channels.append(channel)
+        embeds = []
+        for page in paginate([channels[t].mention for t in thread_ids if t in channels]):
+            embed = discord.Embed(title='Your claimed tickets:', color=self.bot.main_color)
+            embed.description = page
+            embeds.append(embed)
 
-        embed = discord.Embed(title='Your claimed tickets:', color=self.bot.main_color)
-        embed.description = ', '.join(ch.mention for ch in channels)
-        await ctx.send(embed=embed)
+        session = EmbedPaginatorSession(ctx, *embeds)
+        await session.run()
 
     @checks.has_permissions(PermissionLevel.SUPPORTER)
     @claim_.command()
     async def cleanup(self, ctx):
         """Cleans up the database for deleted tickets"""
-        cursor = self.db.find({'guild':str(self.bot.modmail_guild.id)})
-        count = 0
-        async for x in cursor:
-            try:
-                channel = ctx.guild.get_channel(int(x['thread_id'])) or await self.bot.fetch_channel(int(x['thread_id']))
-            except discord.NotFound:
-                await self.db.delete_one({'thread_id': x['thread_id'], 'guild': x['guild']})
-                count += 1
+        thread_ids, _ = await self.store.thread_ids()
+        count = await self.delete_threads(await self.find_deleted_threads(self.bot.modmail_guild, thread_ids))
 
         embed = discord.Embed(color=self.bot.main_color)
         embed.description = f"Cleaned up {count} closed tickets records"
@@ -149,9 +2287,7 @@ class ClaimThread(commands.Cog):
         """Unclaim a thread"""
         embed = discord.Embed(color=self.bot.main_color)
         description = ""
-        thread = await self.db.find_one({'thread_id': str(ctx.thread.channel.id), 'guild': str(self.bot.modmail_guild.id)})
-        if thread and str(ctx.author.id) in thread['claimers']:
-            await self.db.find_one_and_update({'thread_id': str(ctx.thread.channel.id), 'guild': str(self.bot.modmail_guild.id)}, {'$pull': {'claimers': str(ctx.author.id)}})
+        if await self.remove_claimer(ctx.thread.channel.id, ctx.author.id):
             description += 'Removed from claimers.\n'
 
         if str(ctx.thread.id) not in self.bot.config["subscriptions"]:
@@ -161,7 +2297,7 @@ class ClaimThread(commands.Cog):
 
         if ctx.author.mention in mentions:
             mentions.remove(ctx.author.mention)
-            await self.bot.config.update()
+            self.save_subscriptions()
             description += f"{ctx.author.mention} is now unsubscribed from this thread."
 
         if description == "":
@@ -173,47 +2309,69 @@ class ClaimThread(commands.Cog):
     @checks.has_permissions(PermissionLevel.MODERATOR)
     @checks.thread_only()
     @commands.command()
-    async def forceclaim(self, ctx, *, member: discord.Member):
-        """Make a user froce claim an already claimed thread"""
-        if not await self.check_claimer(ctx, member.id):
-            return await ctx.reply(f"Limit reached, can't claim the thread.")
-
-        thread = await self.db.find_one({'thread_id': str(ctx.thread.channel.id), 'guild': str(self.bot.modmail_guild.id)})
-        if thread is None:
-            await self.db.insert_one({'thread_id': str(ctx.thread.channel.id), 'guild': str(self.bot.modmail_guild.id), 'claimers': [str(member.id)]})
-            await ctx.send(f'{member.name} is added to claimers')
-        elif str(member.id) not in thread['claimers']:
-            await self.db.find_one_and_update({'thread_id': str(ctx.thread.channel.id), 'guild': str(self.bot.modmail_guild.id)}, {'$addToSet': {'claimers': str(member.id)}})
-            await ctx.send(f'{member.name} is added to claimers')
-        else:
-            await ctx.send(f'{member.name} is already in claimers')
+    async def forceclaim(self, ctx, members: commands.Greedy[discord.Member], *, member: discord.Member = None):
+        """Make one or more users force claim an already claimed thread"""
+        members = self.unique_members(members, member)
+        if not members:
+            return await ctx.send_help(ctx.command)
+
+        claimers = await self.get_claimers(ctx.thread.channel.id)
+        async with contextlib.AsyncExitStack() as reservations:
+            for member in members:
+                if str(member.id) in claimers:
+                    continue
+                if not await reservations.enter_async_context(self.reserve_claims(ctx, member.id)):
+                    return await ctx.reply(f"Limit reached for {member.name}, can't claim the thread.")
+
+            added = await self.add_claimers(ctx.thread.channel.id, [m.id for m in members])
+        await ctx.send(embed=self.members_embed('Force claim', members, added, 'Added', 'Already claimers'))
 
     @checks.has_permissions(PermissionLevel.MODERATOR)
     @checks.thread_only()
     @commands.command()
-    async def forceunclaim(self, ctx, *, member: discord.Member):
-        """Force remove a user from the thread claimers"""
-        thread = await self.db.find_one({'thread_id': str(ctx.thread.channel.id), 'guild': str(self.bot.modmail_guild.id)})
-        if thread:
-            if str(member.id) in thread['claimers']:
-                await self.db.find_one_and_update({'thread_id': str(ctx.thread.channel.id), 'guild': str(self.bot.modmail_guild.id)}, {'$pull': {'claimers': str(member.id)}})
-                await ctx.send(f'{member.name} is removed from claimers')
-            else:
-                await ctx.send(f'{member.name} is not in claimers')
-        else:
-            await ctx.send(f'No one claimed this thread yet')
+    async def forceunclaim(self, ctx, members: commands.Greedy[discord.Member], *, member: discord.Member = None):
+        """Force remove one or more users from the thread claimers"""
+        members = self.unique_members(members, member)
+        if not members:
+            return await ctx.send_help(ctx.command)
+
+        removed = await self.remove_claimers(ctx.thread.channel.id, [m.id for m in members])
+        if not removed and not await self.get_claimers(ctx.thread.channel.id):
+            return await ctx.send('No one claimed this thread yet')
+
+        await ctx.send(embed=self.members_embed('Force unclaim', members, removed, 'Removed', 'Not claimers'))
+
+    @staticmethod
+    def unique_members(members, member=None):
+        """
+        The members a force command was given, in order and without repeats
+        A lone name with spaces doesn't convert word by word, it ends up in member
+        """
+        members = [*members, member] if member is not None else list(members)
+        return list({m.id: m for m in members}.values())
+
+    def members_embed(self, title, members, changed, changed_name, unchanged_name):
+        """One summary of which members a force command changed"""
+        embed = discord.Embed(title=title, color=self.bot.main_color)
+        for name, group in (
+            (changed_name, [m for m in members if str(m.id) in changed]),
+            (unchanged_name, [m for m in members if str(m.id) not in changed]),
+        ):
+            if group:
+                embed.add_field(name=name, value=paginate([m.mention for m in group], limit=1024)[0], inline=False)
+        return embed
 
     @checks.has_permissions(PermissionLevel.SUPPORTER)
     @checks.thread_only()
     @commands.command()
     async def addclaim(self, ctx, *, member: discord.Member):
         """Adds another user to the thread claimers"""
-        if not await self.check_claimer(ctx, member.id):
-            return await ctx.reply(f"Limit reached, can't claim the thread.")
+        async with self.reserve_claims(ctx, member.id) as allowed:
+            if not allowed:
+                return await ctx.reply("Limit reached, can't claim the thread.")
+            added = await self.add_claimer(ctx.thread.channel.id, member.id, required=ctx.author.id)
 
-        thread = await self.db.find_one({'thread_id': str(ctx.thread.channel.id), 'guild': str(self.bot.modmail_guild.id)})
-        if thread and str(ctx.author.id) in thread['claimers']:
-            await self.db.find_one_and_update({'thread_id': str(ctx.thread.channel.id), 'guild': str(self.bot.modmail_guild.id)}, {'$addToSet': {'claimers': str(member.id)}})
+        if added:
             await ctx.send('Added to claimers')
 
     @checks.has_permissions(PermissionLevel.SUPPORTER)
@@ -221,9 +2379,7 @@ class ClaimThread(commands.Cog):
     @commands.command()
     async def removeclaim(self, ctx, *, member: discord.Member):
         """Removes a user from the thread claimers"""
-        thread = await self.db.find_one({'thread_id': str(ctx.thread.channel.id), 'guild': str(self.bot.modmail_guild.id)})
-        if thread and str(ctx.author.id) in thread['claimers']:
-            await self.db.find_one_and_update({'thread_id': str(ctx.thread.channel.id), 'guild': str(self.bot.modmail_guild.id)}, {'$pull': {'claimers': str(member.id)}})
+        if await self.remove_claimer(ctx.thread.channel.id, member.id, required=ctx.author.id):
             await ctx.send('Removed from claimers')
 
     @checks.has_permissions(PermissionLevel.SUPPORTER)
@@ -231,12 +2387,12 @@ class ClaimThread(commands.Cog):
     @commands.command()
     async def transferclaim(self, ctx, *, member: discord.Member):
         """Removes all users from claimers and gives another member all control over thread"""
-        if not await self.check_claimer(ctx, member.id):
-            return await ctx.reply(f"Limit reached, can't claim the thread.")
+        async with self.reserve_claims(ctx, member.id) as allowed:
+            if not allowed:
+                return await ctx.reply("Limit reached, can't claim the thread.")
+            transferred = await self.set_claimers(ctx.thread.channel.id, [str(member.id)], required=ctx.author.id)
 
-        thread = await self.db.find_one({'thread_id': str(ctx.thread.channel.id), 'guild': str(self.bot.modmail_guild.id)})
-        if thread and str(ctx.author.id) in thread['claimers']:
-            await self.db.find_one_and_update({'thread_id': str(ctx.thread.channel.id), 'guild': str(self.bot.modmail_guild.id)}, {'$set': {'claimers': [str(member.id)]}})
+        if transferred:
             await ctx.send('Added to claimers')
 
     @checks.has_permissions(PermissionLevel.MODERATOR)
@@ -244,9 +2400,7 @@ class ClaimThread(commands.Cog):
     @commands.command()
     async def overrideaddclaim(self, ctx, *, member: discord.Member):
         """Allow mods to bypass claim thread check in add"""
-        thread = await self.db.find_one({'thread_id': str(ctx.thread.channel.id), 'guild': str(self.bot.modmail_guild.id)})
-        if thread:
-            await self.db.find_one_and_update({'thread_id': str(ctx.thread.channel.id), 'guild': str(self.bot.modmail_guild.id)}, {'$addToSet': {'claimers': str(member.id)}})
+        if await self.add_claimer(ctx.thread.channel.id, member.id):
             await ctx.send('Added to claimers')
 
 
@@ -258,21 +2412,177 @@ class ClaimThread(commands.Cog):
         Set max threads a member can claim
         0 = No limit
         """
-        if await self.db.find_one({'_id': 'config'}):
-            await self.db.find_one_and_update({'_id': 'config'}, {'$set': {'limit': limit}})
-        else:
-            await self.db.insert_one({'_id': 'config', 'limit': limit})
-
+        await self.update_config({'$set': {'limit': limit}})
         await ctx.send(f'Set limit to {limit}')
 
+    @checks.has_permissions(PermissionLevel.MODERATOR)
+    @commands.guild_only()
+    @claim_.command(name='reaper')
+    async def claim_reaper(self, ctx, enabled: bool):
+        """
+        Enable or disable the background cleanup of deleted tickets
+        It sweeps the database a batch at a time, so `claim cleanup` is rarely needed
+        """
+        await self.update_config({'$set': {'reaper': enabled}})
+        await ctx.send(f"Background cleanup {'enabled' if enabled else 'disabled'}")
+
+    @checks.has_permissions(PermissionLevel.MODERATOR)
+    @commands.guild_only()
+    @claim_.command(name='idle')
+    async def claim_idle(self, ctx, minutes: int):
+        """
+        Unclaim threads whose claimers haven't replied for this many minutes
+        0 = Never
+        """
+        await self.update_config({'$set': {'idle': minutes}})
+        # timers armed under the old setting take the new one, the rest are armed by seeding
+        self.timers.rearm('idle', minutes * 60)
+        await self.seed_waiting()
+        await ctx.send(f'Claims expire after {minutes} idle minutes' if minutes else 'Claims never expire')
+
+    @checks.has_permissions(PermissionLevel.MODERATOR)
+    @commands.guild_only()
+    @claim_.command(name='sla')
+    async def claim_sla(self, ctx, minutes: int):
+        """
+        Alert the log channel when a thread stays unclaimed for this many minutes
+        0 = Never
+        """
+        await self.update_config({'$set': {'sla': minutes}})
+        self.timers.rearm('sla', minutes * 60)
+        await self.seed_waiting()
+        await ctx.send(f'Alerting after {minutes} unclaimed minutes' if minutes else 'Unclaimed threads are not alerted on')
+
+    @checks.has_permissions(PermissionLevel.MODERATOR)
+    @commands.guild_only()
+    @claim_.group(name='bulk', invoke_without_command=True)
+    async def claim_bulk(self, ctx):
+        """Change the claims of many threads at once"""
+        await ctx.send_help(ctx.command)
+
+    @checks.has_permissions(PermissionLevel.MODERATOR)
+    @commands.guild_only()
+    @claim_bulk.command(name='transfer')
+    async def claim_bulk_transfer(self, ctx, source: discord.User, target: discord.Member):
+        """
+        Give every thread claimed by one member to another, e.g. at the end of a shift
+        Other claimers of those threads keep their claim
+        """
+        if source.id == target.id:
+            return await ctx.send_help(ctx.command)
+
+        changes = {}
+        for thread_id, claimers in (await self.store.threads_of(source.id)).items():
+            new = [str(target.id) if c == str(source.id) else c for c in claimers]
+            changes[thread_id] = (claimers, list(dict.fromkeys(new)))
+
+        new_claims = sum(str(target.id) not in old for old, _ in changes.values())
+        async with self.reserve_claims(ctx, target.id, new_claims) as allowed:
+            if not allowed:
+                return await ctx.reply(f"{target.name} can't claim {new_claims} more threads, limit reached.")
+            count = await self.replace_claimers(changes)
+
+        embed = discord.Embed(title='Bulk transfer', color=self.bot.main_color)
+        embed.description = f'Transferred {count} threads from {source.mention} to {target.mention}'
+        if count < len(changes):
+            embed.description += f'\n{len(changes) - count} threads changed meanwhile and were skipped'
+        if changes:
+            embed.add_field(name='Threads', value=paginate([f'<#{t}>' for t in changes], limit=1024)[0], inline=False)
+        await ctx.send(embed=embed)
+
+    @checks.has_permissions(PermissionLevel.MODERATOR)
+    @commands.guild_only()
+    @claim_bulk.command(name='release')
+    async def claim_bulk_release(self, ctx, member: discord.User):
+        """
+        Remove a member from the claimers of every thread
+        This happens on its own when a supporter leaves the server or loses their role
+        """
+        threads = await self.release_member(member)
+        await ctx.send(embed=self.release_embed(member, threads, f'by {ctx.author.mention}'))
+
+    @checks.has_permissions(PermissionLevel.MODERATOR)
+    @commands.guild_only()
+    @claim_.group(name='board', invoke_without_command=True)
+    async def claim_board(self, ctx, channel: discord.TextChannel = None):
+        """
+        Post a live board of the open threads, their claimers and their age, here or in the given channel
+        It is edited in place as threads are claimed, unclaimed and closed, replacing the previous board
+        """
+        channel = channel or ctx.channel
+        message = await channel.send(embed=discord.Embed(description='Loading the claim board...', color=self.bot.main_color))
+        old = (await self.get_config()).board
+        await self.update_config({'$set': {'board': [channel.id, message.id]}})
+        if old is not None and (old_channel := self.bot.get_channel(old[0])) is not None:
+            with contextlib.suppress(discord.HTTPException):
+                await old_channel.get_partial_message(old[1]).delete()
+
+        await self.build_board()
+        if channel != ctx.channel:
+            await ctx.send(f'Claim board posted in {channel.mention}')
+
+    @checks.has_permissions(PermissionLevel.MODERATOR)
+    @commands.guild_only()
+    @claim_board.command(name='off')
+    async def claim_board_off(self, ctx):
+        """Stop keeping the claim board up to date"""
+        await self.update_config({'$set': {'board': None}})
+        self.board_threads = None
+        await ctx.send('Claim board turned off')
+
+    @checks.has_permissions(PermissionLevel.MODERATOR)
+    @commands.guild_only()
+    @claim_.command(name='report')
+    async def claim_report(self, ctx, days: int = 7, member: discord.User = None):
+        """
+        Show the claims of every supporter over the last days (max 365), or of one member
+        Read from the daily rollups, so it costs the same however many claims there were
+        """
+        days = max(1, min(days, 365))
+        # include the events still waiting for their batch
+        await self.write_events()
+        since = (discord.utils.utcnow() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+
+        totals = {}
+        for _, claimer_id, counts in await self.store.rollups('day', since):
+            if member is None or claimer_id == str(member.id):
+                totals.setdefault(claimer_id, Counter()).update(counts)
+
+        lines = [f"{'supporter':<20}{'claims':>8}{'reclaims':>10}{'joins':>8}{'leaves':>8}{'median wait':>14}"]
+        for claimer_id, counts in sorted(totals.items(), key=lambda x: (-x[1]['claim'], x[0])):
+            user = self.bot.get_user(int(claimer_id))
+            name = user.name if user else claimer_id
+            wait = median_wait(counts)
+            if wait is None:
+                wait = '-'
+            elif wait == math.inf:
+                wait = f'> {WAIT_BUCKETS[-2]} min'
+            else:
+                wait = f'<= {wait} min'
+            lines.append(
+                f"{name[:19]:<20}{counts['claim']:>8.0f}{counts['reclaim']:>10.0f}{counts['join']:>8.0f}{counts['leave']:>8.0f}{wait:>14}"
+            )
+        if not totals:
+            lines.append('No claims in this period')
+
+        embeds = []
+        for page in paginate(lines, limit=4000, separator='\n'):
+            embed = discord.Embed(title=f'Claim report, last {days} days', color=self.bot.main_color)
+            embed.description = f'```\n{page}\n```'
+            embeds.append(embed)
+
+        session = EmbedPaginatorSession(ctx, *embeds)
+        await session.run()
+
     @checks.has_permissions(PermissionLevel.MODERATOR)
     @commands.guild_only()
     @claim_.group(name='bypass', invoke_without_command=True)
     async def claim_bypass_(self, ctx):
         """Manage bypass roles to claim check"""
         if not ctx.invoked_subcommand:
-            if (roles_guild:= await self.db.find_one({'_id': 'config'})) and len(roles_guild['bypass_roles']) != 0:
-                added = ", ".join(f"`{ctx.guild.get_role(r).name}`" for r in roles_guild['bypass_roles'])
+            roles = [ctx.guild.get_role(r) for r in (await self.get_config()).bypass_roles]
+            if roles := [r for r in roles if r is not None]:
+                added = ", ".join(f"`{r.name}`" for r in roles)
                 await ctx.send(f'By-pass roles: {added}')
             else:
                 await ctx.send_help(ctx.command)
@@ -294,11 +2604,7 @@ class ClaimThread(commands.Cog):
                 bypass_roles.append(role)
 
         if len(bypass_roles) != 0:
-            if await self.db.find_one({'_id': 'config'}):
-                for role in bypass_roles:
-                    await self.db.find_one_and_update({'_id': 'config'}, {'$addToSet': {'bypass_roles': role.id}})
-            else:
-                await self.db.insert_one({'_id': 'config', 'bypass_roles': [r.id for r in bypass_roles]})
+            await self.update_config({'$addToSet': {'bypass_roles': {'$each': [r.id for r in bypass_roles]}}})
             added = ", ".join(f"`{r.name}`" for r in bypass_roles)
            
         else:
@@ -311,9 +2617,8 @@ class ClaimThread(commands.Cog):
     @claim_bypass_.command(name='remove')
     async def claim_bypass_remove(self, ctx, role: discord.Role):
         """Remove a bypass role from claim check"""
-        roles_guild = await self.db.find_one({'_id': 'config'})
-        if roles_guild and role.id in roles_guild['bypass_roles']:
-            await self.db.find_one_and_update({'_id': 'config'}, {'$pull': {'bypass_roles': role.id}})
+        if role.id in (await self.get_config()).bypass_roles:
+            await self.update_config({'$pull': {'bypass_roles': role.id}})
             await ctx.send(f'**Removed from by-pass roles**:\n`{role.name}`')
         else:
             await ctx.send(f'`{role.name}` is not in by-pass roles')
@@ -325,17 +2630,155 @@ class ClaimThread(commands.Cog):
         """Allow mods to bypass claim thread check in reply"""
         await ctx.invoke(self.bot.get_command('reply'), msg=msg)
 
+    @checks.has_permissions(PermissionLevel.ADMINISTRATOR)
+    @claim_.command(name='trace')
+    async def claim_trace(self, ctx, enabled: bool):
+        """
+        Turn span tracing of claim commands on or off
+        Spans are written to `claim_trace.jsonl` in `~/.local/share/modmail` or `$XDG_DATA_HOME/modmail`, rotated at 10 MB
+        """
+        await self.update_config({'$set': {'trace': enabled}})
+        await ctx.send(f"Tracing {'enabled' if enabled else 'disabled'}")
+
+    @checks.has_permissions(PermissionLevel.ADMINISTRATOR)
+    @claim_.command(name='profile')
+    async def claim_profile(self, ctx, seconds: float = 10):
+        """
+        Sample what the event loop is doing for a few seconds (max 120)
+        Uploads the hot spots and the sampled stacks in collapsed format for flame graph tools
+        """
+        seconds = max(1.0, min(seconds, 120.0))
+        await ctx.send(f'Profiling the event loop for {seconds:g}s...')
+        stacks = await asyncio.to_thread(sample_stacks, threading.get_ident(), seconds)
+
+        total = sum(stacks.values()) or 1
+        idle = claim = 0
+        own = Counter()
+        inclusive = Counter()
+        for stack, count in stacks.items():
+            leaf = stack[-1]
+            if os.path.basename(leaf.co_filename) == 'selectors.py' or leaf.co_name in ('select', 'poll'):
+                idle += count
+                continue
+            own[leaf] += count
+            ours = {code for code in stack if code.co_filename == __file__}
+            if ours:
+                claim += count
+            for code in ours:
+                inclusive[code] += count
+
+        lines = [
+            f'{total} samples: {claim / total:.1%} ClaimThread, '
+            f'{(total - claim - idle) / total:.1%} rest of the bot, {idle / total:.1%} idle',
+            '',
+            'Hottest functions (self time):',
+        ]
+        lines += [f'{count / total:>6.1%}  {frame_label(code)}' for code, count in own.most_common(10)]
+        lines += ['', 'ClaimThread (including callees):']
+        lines += [f'{count / total:>6.1%}  {frame_label(code)}' for code, count in inclusive.most_common(10)]
+
+        folded = ''.join(
+            ';'.join(frame_label(code) for code in stack) + f' {count}\n' for stack, count in stacks.items()
+        )
+        embed = discord.Embed(title='Claim profile', color=self.bot.main_color)
+        embed.description = '```\n' + '\n'.join(lines)[:4000] + '\n```'
+        await ctx.send(embed=embed, file=discord.File(io.BytesIO(folded.encode()), filename='claim_profile.folded'))
+
+    @checks.has_permissions(PermissionLevel.MODERATOR)
+    @claim_.command(name='stats')
+    async def claim_stats(self, ctx):
+        """Show latency percentiles of every claim command, check, listener and database call"""
+        lines = [f"{'operation':<36}{'count':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"]
+        for name in sorted(self.metrics.histograms):
+            count = sum(self.metrics.histograms[name])
+            percentiles = ''.join(f'{self.metrics.percentile(name, p) * 1000:>9.2f}' for p in (50, 95, 99))
+            lines.append(f'{name:<36}{count:>8}{percentiles}')
+
+        counters = self.metrics.counters
+        if lookups := counters['cache.hit'] + counters['cache.miss']:
+            lines.append(f"\ncache hit rate {counters['cache.hit'] / lookups:.1%} of {lookups} lookups")
+
+        embeds = []
+        for page in paginate(lines, limit=4000, separator='\n'):
+            embed = discord.Embed(title='Claim stats', color=self.bot.main_color)
+            embed.description = f'```\n{page}\n```'
+            embeds.append(embed)
+
+        session = EmbedPaginatorSession(ctx, *embeds)
+        await session.run()
+
+    @checks.has_permissions(PermissionLevel.MODERATOR)
+    @commands.guild_only()
+    @claim_.command(name='diagnostics')
+    async def claim_diagnostics(self, ctx):
+        """Show the query plan of every hot claim query"""
+        embed = discord.Embed(title='Claim query plans', color=self.bot.main_color)
+        plans = await self.store.query_plans(ctx.channel.id, ctx.author.id)
+        for name, plan, _ in plans:
+            embed.add_field(name=name, value=plan, inline=False)
+
+        scans = sum(scan for _, _, scan in plans)
+        if not plans:
+            embed.description = 'This claim store has no query plans'
+        else:
+            embed.description = f'{scans} full scans' if scans else 'No full scans'
+        if not self.store.unique_threads:
+            embed.description += '\nThe thread index is not unique, two first claims of a thread can both go through'
+        await ctx.send(embed=embed)
+
+
+def sample_stacks(thread_id, seconds, interval=0.005):
+    """Sample the stack of a thread every interval for a while, returns how often each stack was seen"""
+    stacks = Counter()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None and len(stack) < 128:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        if stack:
+            stacks[tuple(reversed(stack))] += 1
+        del frame
+        time.sleep(interval)
+    return stacks
+
+
+def frame_label(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def paginate(items, limit=4096, separator=', '):
+    """Join items into pages that each fit in an embed description"""
+    pages = ['']
+    for item in items:
+        if pages[-1] and len(pages[-1]) + len(separator) + len(item) > limit:
+            pages.append('')
+        pages[-1] += f'{separator}{item}' if pages[-1] else item
+    return pages
+
+
+def plan_stages(plan):
+    """Flatten an explain() plan into (stage, index name) pairs, outermost first"""
+    stages = [(plan.get('stage'), plan.get('indexName'))]
+    for child in [plan.get('inputStage'), *plan.get('inputStages', [])]:
+        if child:
+            stages += plan_stages(child)
+    return stages
+
+
 async def check_reply(ctx):
-    thread = await ctx.bot.get_cog('ClaimThread').db.find_one({'thread_id': str(ctx.thread.channel.id), 'guild': str(ctx.bot.modmail_guild.id)})
-    if thread and len(thread['claimers']) != 0:
-        in_role = False
-        if config:= await ctx.bot.get_cog('ClaimThread').db.find_one({'_id': 'config'}):
-            if 'bypass_roles' in config:
-                roles = [ctx.guild.get_role(r) for r in config['bypass_roles'] if ctx.guild.get_role(r) is not None]
-                for role in roles:
-                    if role in ctx.author.roles:
-                        in_role = True
-        return ctx.author.bot or in_role or str(ctx.author.id) in thread['claimers']
+    cog = ctx.bot.get_cog('ClaimThread')
+    return await cog.metrics.timed('check.check_reply', reply_allowed(cog, ctx))
+
+
+async def reply_allowed(cog, ctx):
+    claimers = await cog.get_claimers(ctx.thread.channel.id)
+    if claimers:
+        if ctx.author.bot or str(ctx.author.id) in claimers:
+            return True
+        config = await cog.get_config()
+        return not config.bypass_roles.isdisjoint(r.id for r in ctx.author.roles)
     return True
 
 
@@ -1,10 +1,22 @@
+import asyncio
+import contextlib
+from collections import Counter, OrderedDict, namedtuple
+from datetime import timedelta
+
 import discord
 from discord.ext import commands
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
 
 from core import checks
-from core.models import PermissionLevel
+from core.models import PermissionLevel, getLogger
 from core.utils import match_user_id
 
+logger = getLogger(__name__)
+
+# Неизменяемый снимок документа config, заменяется целиком при каждой записи
+ClaimConfig = namedtuple('ClaimConfig', ['limit', 'bypass_roles'])
+
 
 class ClaimThread(commands.Cog):
     """Позволяет поддерживающим пользователям брать тикеты, отправляя команду claim в канале тикета"""
@@ -12,6 +24,15 @@ class ClaimThread(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.db = bot.api.get_plugin_partition(self)
+        # thread_id -> claimers, недавно использованные в конце
+        self.cache = OrderedDict()
+        self.cache_size = 10000
+        # claimer_id -> количество взятых тикетов, загружается при первом использовании
+        self.claim_counts = None
+        self.claim_counts_lock = asyncio.Lock()
+        # claimer_id -> тикеты, занятые под записи в процессе, чтобы одновременные взятия не прошли лимит вместе
+        self.reserved = Counter()
+        self.claim_config = None
         check_reply.fail_msg = 'Этот тикет был взят другим пользователем.'
         self.bot.get_command('reply').add_check(check_reply)
         self.bot.get_command('areply').add_check(check_reply)
@@ -20,22 +41,151 @@ class ClaimThread(commands.Cog):
         
         # Добавляем параметр для канала уведомлений
         self.notification_channel_id = None  # Установите здесь ID вашего канала уведомлений
+        # Уведомления копятся и отправляются одной сводкой не чаще раза в digest_interval секунд
+        # или сразу по накоплении digest_size событий
+        self.digest = []
+        self.digest_task = None
+        self.digest_interval = 60
+        self.digest_size = 20
+        # Взятие тикета, прождавшего дольше этого, отправляется сразу
+        self.urgent_after = timedelta(hours=1)
+
+    async def cog_load(self):
+        try:
+            # claim_thread полагается на этот индекс, чтобы отклонить повторный upsert того же тикета
+            await self.db.create_index([('thread_id', 1), ('guild', 1)], unique=True)
+        except OperationFailure:
+            logger.warning('Не удалось создать уникальный индекс тикетов, в базе есть дубликаты.')
+
+    async def cog_unload(self):
+        await self.flush_digest()
+
+    def cache_set(self, thread_id, claimers):
+        """Сохранить взявших тикет, вытесняя давно не использованные тикеты"""
+        thread_id = str(thread_id)
+        self.cache[thread_id] = tuple(claimers)
+        self.cache.move_to_end(thread_id)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def get_claimers(self, thread_id):
+        """Получить взявших тикет из кэша, загружая их из базы при промахе"""
+        thread_id = str(thread_id)
+        if thread_id in self.cache:
+            self.cache.move_to_end(thread_id)
+            return self.cache[thread_id]
+
+        thread = await self.db.find_one({'thread_id': thread_id, 'guild': str(self.bot.modmail_guild.id)})
+        self.cache_set(thread_id, thread.get('claimers', []) if thread else [])
+        return self.cache[thread_id]
+
+    async def load_claim_counts(self):
+        """Один раз посчитать количество взятых тикетов у каждого одной агрегацией"""
+        if self.claim_counts is not None:
+            return
+
+        async with self.claim_counts_lock:
+            if self.claim_counts is not None:
+                return
+
+            counts = Counter()
+            pipeline = [
+                {'$match': {'guild': str(self.bot.modmail_guild.id)}},
+                {'$unwind': '$claimers'},
+                {'$group': {'_id': '$claimers', 'count': {'$sum': 1}}},
+            ]
+            async for x in self.db.aggregate(pipeline):
+                counts[x['_id']] = x['count']
+            self.claim_counts = counts
+
+    def count_claims(self, removed=(), added=()):
+        """Обновить счётчики взятых тикетов после изменения взявших"""
+        if self.claim_counts is None:
+            return
+
+        for claimer in removed:
+            self.claim_counts[claimer] -= 1
+            if self.claim_counts[claimer] <= 0:
+                del self.claim_counts[claimer]
+        for claimer in added:
+            self.claim_counts[claimer] += 1
+
+    async def claim_thread(self, thread_id, claimer_id):
+        """Взять свободный тикет одной атомарной записью, возвращает тикет, если взятие удалось"""
+        await self.load_claim_counts()
+        try:
+            thread = await self.db.find_one_and_update(
+                {'thread_id': str(thread_id), 'guild': str(self.bot.modmail_guild.id), 'claimers.0': {'$exists': False}},
+                {'$set': {'claimers': [str(claimer_id)]}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # документ тикета существует, и его уже кто-то взял
+            return None
+
+        self.count_claims(added=[str(claimer_id)])
+        self.cache_set(thread_id, thread['claimers'])
+        return thread
+
+    async def delete_thread(self, thread_id):
+        """Удалить документ тикета и убрать его из кэша"""
+        await self.load_claim_counts()
+        thread = await self.db.find_one_and_delete({'thread_id': str(thread_id), 'guild': str(self.bot.modmail_guild.id)})
+        if thread is not None:
+            self.count_claims(removed=thread.get('claimers', []))
+        self.cache.pop(str(thread_id), None)
+
+    def set_config(self, config):
+        """Заменить снимок настроек новым, построенным из документа config"""
+        config = config or {}
+        self.claim_config = ClaimConfig(config.get('limit'), frozenset(config.get('bypass_roles', [])))
+        return self.claim_config
+
+    async def get_config(self):
+        """Получить снимок настроек, читая документ config только в первый раз"""
+        if self.claim_config is None:
+            return self.set_config(await self.db.find_one({'_id': 'config'}))
+        return self.claim_config
+
+    async def update_config(self, update):
+        """Обновить документ config и заменить снимок настроек результатом"""
+        config = await self.db.find_one_and_update(
+            {'_id': 'config'},
+            update,
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return self.set_config(config)
 
     async def check_claimer(self, ctx, claimer_id):
-        config = await self.db.find_one({'_id': 'config'})
-        if config and 'limit' in config:
-            if config['limit'] == 0:
-                return True
-        else:
+        config = await self.get_config()
+        if config.limit is None:
             raise commands.BadArgument(f"Сначала установите лимит. `{ctx.prefix}claim limit`")
+        if config.limit == 0:
+            return True
 
-        cursor = self.db.find({'guild': str(self.bot.modmail_guild.id)})
-        count = 0
-        async for x in cursor:
-            if 'claimers' in x and str(claimer_id) in x['claimers']:
-                count += 1
+        await self.load_claim_counts()
+        claimer_id = str(claimer_id)
+        return self.claim_counts[claimer_id] + self.reserved[claimer_id] < config.limit
 
-        return count < config['limit']
+    @contextlib.asynccontextmanager
+    async def reserve_claim(self, ctx, claimer_id):
+        """
+        Занять место в лимите участника на время записи внутри, отдаёт, помещается ли взятие
+        Место занимается сразу после проверки без await между ними и освобождается на выходе,
+        к этому моменту удачная запись уже учтена в счётчиках
+        """
+        claimer_id = str(claimer_id)
+        allowed = await self.check_claimer(ctx, claimer_id)
+        held = 1 if allowed and self.claim_config.limit else 0
+        self.reserved[claimer_id] += held
+        try:
+            yield allowed
+        finally:
+            self.reserved[claimer_id] -= held
+            if self.reserved[claimer_id] <= 0:
+                del self.reserved[claimer_id]
 
     async def check_before_update(self, channel):
         if channel.guild != self.bot.modmail_guild or await self.bot.api.get_log(channel.id) is None:
@@ -43,10 +193,49 @@ class ClaimThread(commands.Cog):
 
         return True
 
+    async def notify(self, text, urgent=False):
+        """Отправить событие в канал уведомлений: срочное сразу, остальные в следующей сводке"""
+        if not self.notification_channel_id:
+            return
+
+        if urgent:
+            if notification_channel := self.bot.get_channel(self.notification_channel_id):
+                await notification_channel.send(text)
+            return
+
+        self.digest.append(text)
+        if len(self.digest) >= self.digest_size:
+            await self.flush_digest()
+        elif self.digest_task is None:
+            self.digest_task = asyncio.create_task(self.digest_timer())
+
+    async def digest_timer(self):
+        await asyncio.sleep(self.digest_interval)
+        self.digest_task = None
+        await self.flush_digest()
+
+    async def flush_digest(self):
+        """Отправить накопленные события одним сообщением"""
+        if self.digest_task is not None:
+            self.digest_task.cancel()
+            self.digest_task = None
+
+        events, self.digest = self.digest, []
+        notification_channel = self.bot.get_channel(self.notification_channel_id) if self.notification_channel_id else None
+        if not events or notification_channel is None:
+            return
+
+        embed = discord.Embed(
+            title=f"Взято тикетов: {len(events)}",
+            description="\n".join(events)[:4096],
+            color=discord.Color.green()
+        )
+        await notification_channel.send(embed=embed)
+
     @commands.Cog.listener()
     async def on_guild_channel_delete(self, channel):
         if await self.check_before_update(channel):
-            await self.db.delete_one({'thread_id': str(channel.id), 'guild': str(self.bot.modmail_guild.id)})
+            await self.delete_thread(channel.id)
 
     @commands.command()
     @checks.has_permissions(PermissionLevel.SUPPORTER)
@@ -55,21 +244,16 @@ class ClaimThread(commands.Cog):
         claimer_id = str(ctx.author.id)
         channel_id = str(ctx.channel.id)
 
-        if not await self.check_claimer(ctx, claimer_id):
-            await ctx.send("Вы превысили лимит взятых тикетов.")
-            return
+        async with self.reserve_claim(ctx, claimer_id) as allowed:
+            if not allowed:
+                await ctx.send("Вы превысили лимит взятых тикетов.")
+                return
 
-        thread = await self.db.find_one({'thread_id': channel_id, 'guild': str(self.bot.modmail_guild.id)})
-        if thread and 'claimers' in thread and len(thread['claimers']) != 0:
+            thread = await self.claim_thread(channel_id, claimer_id)
+        if thread is None:
             await ctx.send("Этот тикет уже был взят.")
             return
 
-        await self.db.find_one_and_update(
-            {'thread_id': channel_id, 'guild': str(self.bot.modmail_guild.id)},
-            {'$set': {'claimers': [claimer_id]}},
-            upsert=True
-        )
-
         embed = discord.Embed(
             title="Тикет взят",
             description=f"{ctx.author.mention} взял тикет.",
@@ -78,10 +262,10 @@ class ClaimThread(commands.Cog):
         await ctx.send(embed=embed)
         
         # Уведомление в заданный канал
-        if self.notification_channel_id:
-            notification_channel = self.bot.get_channel(self.notification_channel_id)
-            if notification_channel:
-                await notification_channel.send(f"{ctx.author.mention} взял тикет {ctx.channel.name}.")
+        if discord.utils.utcnow() - ctx.channel.created_at > self.urgent_after:
+            await self.notify(f"{ctx.author.mention} взял тикет {ctx.channel.name}, ожидавший ответа слишком долго.", urgent=True)
+        else:
+            await self.notify(f"{ctx.author.mention} взял тикет {ctx.channel.name}.")
 
     @commands.group(name='claim_bypass', invoke_without_command=True)
     async def claim_bypass_(self, ctx):
@@ -93,11 +277,7 @@ class ClaimThread(commands.Cog):
     @claim_bypass_.command(name='add')
     async def claim_bypass_add(self, ctx, *bypass_roles: discord.Role):
         """Добавить роль для обхода проверки взятия тикета"""
-        config = await self.db.find_one({'_id': 'config'})
-        if not config:
-            await self.db.insert_one({'_id': 'config', 'bypass_roles': [r.id for r in bypass_roles]})
-        else:
-            await self.db.find_one_and_update({'_id': 'config'}, {'$addToSet': {'bypass_roles': {'$each': [r.id for r in bypass_roles]}}})
+        await self.update_config({'$addToSet': {'bypass_roles': {'$each': [r.id for r in bypass_roles]}}})
 
         added = ", ".join(f"`{r.name}`" for r in bypass_roles)
         await ctx.send(f'**Добавлены роли для обхода проверки**:\n{added}')
@@ -107,9 +287,8 @@ class ClaimThread(commands.Cog):
     @claim_bypass_.command(name='remove')
     async def claim_bypass_remove(self, ctx, role: discord.Role):
         """Удалить роль для обхода проверки взятия тикета"""
-        config = await self.db.find_one({'_id': 'config'})
-        if config and 'bypass_roles' in config and role.id in config['bypass_roles']:
-            await self.db.find_one_and_update({'_id': 'config'}, {'$pull': {'bypass_roles': role.id}})
+        if role.id in (await self.get_config()).bypass_roles:
+            await self.update_config({'$pull': {'bypass_roles': role.id}})
             await ctx.send(f'**Удалена роль для обхода проверки**:\n`{role.name}`')
         else:
             await ctx.send(f'`{role.name}` не находится в списке ролей для обхода проверки')
@@ -123,16 +302,13 @@ class ClaimThread(commands.Cog):
 
 
 async def check_reply(ctx):
-    thread = await ctx.bot.get_cog('ClaimThread').db.find_one({'thread_id': str(ctx.thread.channel.id), 'guild': str(ctx.bot.modmail_guild.id)})
-    if thread and len(thread['claimers']) != 0:
-        in_role = False
-        config = await ctx.bot.get_cog('ClaimThread').db.find_one({'_id': 'config'})
-        if config and 'bypass_roles' in config:
-            roles = [ctx.guild.get_role(r) for r in config['bypass_roles'] if ctx.guild.get_role(r) is not None]
-            for role in roles:
-                if role in ctx.author.roles:
-                    in_role = True
-        return ctx.author.bot or in_role or str(ctx.author.id) in thread['claimers']
+    cog = ctx.bot.get_cog('ClaimThread')
+    claimers = await cog.get_claimers(ctx.thread.channel.id)
+    if claimers:
+        if ctx.author.bot or str(ctx.author.id) in claimers:
+            return True
+        config = await cog.get_config()
+        return not config.bypass_roles.isdisjoint(r.id for r in ctx.author.roles)
     return True
 
 